@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: 2026 Kdenlive contributors
+# SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
+
+import json
+import statistics
+from functools import lru_cache
+from math import comb
+from pathlib import Path
+from typing import Any, Optional
+
+
+@lru_cache(maxsize=None)
+def _mannWhitneyCount(m: int, n: int, u: int) -> int:
+    # number of orderings of m + n samples where the m samples are smaller
+    # than exactly u of the pairs
+    if u < 0 or u > m * n:
+        return 0
+    if m == 0 or n == 0:
+        return 1
+    return _mannWhitneyCount(m - 1, n, u - n) + _mannWhitneyCount(m, n - 1, u)
+
+
+def slowdownPValue(samples: list[float], baseline: list[float]) -> float:
+    # One sided exact Mann-Whitney U test: probability that samples are at
+    # least as much slower than baseline if both come from the same
+    # distribution. No assumptions about the distribution of render times.
+    m, n = len(samples), len(baseline)
+    if m == 0 or n == 0:
+        return 1.0
+
+    # number of pairs where the baseline is faster, ties count half (the
+    # p-value is only approximate then)
+    u = sum(1.0 if b < s else 0.5 if b == s else 0.0 for s in samples for b in baseline)
+    # u of the samples is at least observed if the baseline is faster in at
+    # least u pairs, i.e. the samples are smaller in at most m * n - u pairs
+    limit = int(m * n - u)
+    orderings = sum(_mannWhitneyCount(m, n, k) for k in range(limit + 1))
+    return orderings / comb(m + n, m)
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, durations: list[float], frameCount: int):
+        self.name = name
+        self.durations = durations
+        self.frameCount = frameCount
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.durations)
+
+    @property
+    def stddev(self) -> float:
+        return statistics.stdev(self.durations) if len(self.durations) > 1 else 0.0
+
+    @property
+    def fps(self) -> float:
+        return self.frameCount / self.median if self.median > 0 else 0.0
+
+    def toJson(self) -> dict[str, Any]:
+        return {
+            "durations": [round(d, 3) for d in self.durations],
+            "frameCount": self.frameCount,
+            "median": round(self.median, 3),
+            "stddev": round(self.stddev, 3),
+            "fps": round(self.fps, 2),
+        }
+
+
+class Benchmark:
+    # a slowdown is reported if it is significant and the median render
+    # time increased by more than threshold
+    alpha = 0.05
+    threshold = 0.05
+
+    def __init__(self, results: list[BenchmarkResult]):
+        self.results = results
+
+    def save(self, outputFile: Path, components: Optional[Any] = None) -> None:
+        data = {
+            "components": components,
+            "projects": {result.name: result.toJson() for result in self.results},
+        }
+        with open(outputFile, "w") as f:
+            json.dump(data, f, indent=2)
+
+    @staticmethod
+    def loadBaseline(baselineFile: Path) -> dict[str, list[float]]:
+        with open(baselineFile, "r") as f:
+            data = json.load(f)
+        return {
+            name: project["durations"] for name, project in data["projects"].items()
+        }
+
+    def slowdowns(self, baseline: dict[str, list[float]]) -> list[str]:
+        slowdowns: list[str] = []
+        for result in self.results:
+            if result.name not in baseline:
+                continue
+            baselineMedian = statistics.median(baseline[result.name])
+            pValue = slowdownPValue(result.durations, baseline[result.name])
+            if pValue <= self.alpha and result.median > baselineMedian * (
+                1 + self.threshold
+            ):
+                slowdowns += [result.name]
+        return slowdowns
+
+    def report(self, baseline: Optional[dict[str, list[float]]] = None) -> str:
+        string = ["==== BENCHMARK ===="]
+        slowdowns = self.slowdowns(baseline) if baseline else []
+        for result in self.results:
+            line = (
+                f"{result.median:8.2f}s ±{result.stddev:5.2f}s"
+                f" {result.fps:8.1f} fps - {result.name}"
+            )
+            if baseline and result.name in baseline:
+                baselineMedian = statistics.median(baseline[result.name])
+                change = (result.median / baselineMedian - 1) * 100
+                pValue = slowdownPValue(result.durations, baseline[result.name])
+                line += (
+                    f" (baseline {baselineMedian:.2f}s, {change:+.1f}%, p={pValue:.3f})"
+                )
+                if result.name in slowdowns:
+                    line += " SLOWER"
+            string += [line]
+
+        if baseline:
+            string += [
+                f"{len(slowdowns)} significant slowdown(s)"
+                f" (p <= {self.alpha}, median +{self.threshold * 100:.0f}%)"
+            ]
+        return "\n".join(string)
@@ -22,6 +22,12 @@ class CompareResult:
         self.msg = msg
         self.errorDetails: Optional[str] = None
         self.videoErrors: list[tuple[int, int]] = []
+        # highest MSE of each range in videoErrors
+        self.videoErrorMse: list[float] = []
+        # highest MSE of all compared video frames
+        self.videoMaxMse = 0.0
+        # worst value of each video metric over all compared frames
+        self.videoMetrics: dict[str, float] = {}
         self.audioErrors: list[tuple[int, int]] = []
         self.framesDuration = 0
 
@@ -53,6 +59,9 @@ class CompareResult:
         sumRes.errorDetails = _joinOptionalStr(self.errorDetails, other.errorDetails)
 
         sumRes.videoErrors = self.videoErrors + other.videoErrors
+        sumRes.videoErrorMse = self.videoErrorMse + other.videoErrorMse
+        sumRes.videoMaxMse = max(self.videoMaxMse, other.videoMaxMse)
+        sumRes.videoMetrics = {**self.videoMetrics, **other.videoMetrics}
         sumRes.audioErrors = self.audioErrors + other.audioErrors
         sumRes.framesDuration = max(self.framesDuration, other.framesDuration)
 
@@ -15,6 +15,12 @@ class AVType(StrEnum):
     VIDEO = "video"
 
 
+class MetricType(StrEnum):
+    PSNR = "psnr"
+    PLANE_MSE = "plane-mse"
+    SSIM = "ssim"
+
+
 class ExceptionConfig(TypedDict):
     type: ExceptionType
     reason: Optional[str]
@@ -24,7 +30,13 @@ class ExceptionConfig(TypedDict):
     to_frame: int
 
 
+class MetricConfig(TypedDict):
+    type: MetricType
+    threshold: Optional[float]
+
+
 class ProjectConfig(TypedDict):
     filename: str
     description: str
     exceptions: Optional[list[ExceptionConfig]]
+    metrics: Optional[list[MetricConfig]]
@@ -0,0 +1,163 @@
+# SPDX-FileCopyrightText: 2026 Kdenlive contributors
+# SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
+
+import hashlib
+import os
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+ffmpegCommand = os.environ.get("TEST_FFMPEG_CMD", "ffmpeg").split()
+
+# first line of a reference hash file, ties it to the reference content
+referenceHeader = "#reference sha256: "
+
+
+def _fileSha256(mediaFile: str) -> str:
+    h = hashlib.sha256()
+    with open(mediaFile, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def frameHashes(mediaFile: str) -> str:
+    # hash of every decoded frame of the first video and audio stream, murmur3
+    # is much faster than md5 for full resolution frames
+    cmd = ffmpegCommand + [
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        mediaFile,
+        "-map",
+        "0:v:0?",
+        "-map",
+        "0:a:0?",
+        "-fps_mode",
+        "passthrough",
+        "-c:a",
+        "pcm_f32le",
+        "-f",
+        "framehash",
+        "-hash",
+        "murmur3",
+        "-",
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"Hashing the frames of {mediaFile} failed: {result.stderr}")
+    return result.stdout
+
+
+def parseFrameHashes(hashes: str) -> dict[str, list[str]]:
+    # The header and frame lines of each stream by media type. Lines not
+    # belonging to a stream (e.g. the ffmpeg version) are skipped.
+    mediaTypes: dict[str, str] = {}
+    streams: dict[str, list[str]] = {}
+    for line in hashes.splitlines():
+        if line.startswith("#"):
+            # e.g. "#dimensions 0: 320x180"
+            key, separator, value = line[1:].partition(":")
+            parts = key.split()
+            if not separator or len(parts) != 2 or not parts[1].isdigit():
+                continue
+            if parts[0] == "media_type":
+                mediaTypes[parts[1]] = value.strip()
+            streams.setdefault(parts[1], []).append(line)
+        elif line.strip():
+            # e.g. "0,          0,          0,        1,    86400, 43d8105..."
+            streams.setdefault(line.split(",", 1)[0].strip(), []).append(line)
+
+    return {mediaTypes.get(index, index): lines for index, lines in streams.items()}
+
+
+def referenceHashFile(referenceFile: str) -> Path:
+    return Path(f"{referenceFile}.framehash")
+
+
+def updateReferenceHashes(referenceFile: str) -> None:
+    content = referenceHeader + _fileSha256(referenceFile) + "\n"
+    content += frameHashes(referenceFile)
+    referenceHashFile(referenceFile).write_text(content)
+
+
+def loadReferenceHashes(referenceFile: str) -> Optional[dict[str, list[str]]]:
+    # None if there are no hashes or they belong to an other reference content
+    hashFile = referenceHashFile(referenceFile)
+    if not hashFile.is_file():
+        return None
+
+    header, _, hashes = hashFile.read_text().partition("\n")
+    if header != referenceHeader + _fileSha256(referenceFile):
+        return None
+
+    return parseFrameHashes(hashes)
+
+
+class FrameHashComparison:
+    # Frame hashes of a render compared with the ones of the reference
+
+    def __init__(
+        self,
+        referenceHashes: dict[str, list[str]],
+        renderHashes: dict[str, list[str]],
+    ):
+        self.referenceHashes = referenceHashes
+        self.renderHashes = renderHashes
+
+    @property
+    def identicalStreams(self) -> set[str]:
+        # media types ("video", "audio") whose decoded frames are identical
+        return {
+            mediaType
+            for mediaType, lines in self.referenceHashes.items()
+            if self.renderHashes.get(mediaType) == lines
+        }
+
+    def frameCount(self, mediaType: str) -> int:
+        lines = self.referenceHashes.get(mediaType, [])
+        return sum(1 for line in lines if not line.startswith("#"))
+
+    def suspectFrames(self, mediaType: str) -> Optional[list[int]]:
+        # Numbers (starting at 1 like the psnr filter) of the frames whose
+        # hashes differ, each run followed by its next frame so an error range
+        # ends at the same frame as in a comparison of all frames. Identical
+        # frames can not be broken. None if the streams can not be compared
+        # frame by frame or all frames differ.
+        referenceLines = self.referenceHashes.get(mediaType, [])
+        renderLines = self.renderHashes.get(mediaType, [])
+        referenceHeader = [line for line in referenceLines if line.startswith("#")]
+        renderHeader = [line for line in renderLines if line.startswith("#")]
+        referenceFrames = [line for line in referenceLines if not line.startswith("#")]
+        renderFrames = [line for line in renderLines if not line.startswith("#")]
+        if referenceHeader != renderHeader or len(referenceFrames) != len(renderFrames):
+            return None
+
+        frames: list[int] = []
+        previousDiffers = False
+        for index, (referenceFrame, renderFrame) in enumerate(
+            zip(referenceFrames, renderFrames)
+        ):
+            differs = referenceFrame != renderFrame
+            # the first identical frame after differing ones is compared too
+            if differs or previousDiffers:
+                frames += [index + 1]
+            previousDiffers = differs
+
+        if len(frames) == len(referenceFrames):
+            return None
+        return frames
+
+
+def compareFrameHashes(
+    referenceFile: str, renderFile: str
+) -> Optional[FrameHashComparison]:
+    # None without precomputed reference hashes
+    referenceHashes = loadReferenceHashes(referenceFile)
+    if not referenceHashes:
+        return None
+
+    return FrameHashComparison(
+        referenceHashes, parseFrameHashes(frameHashes(renderFile))
+    )
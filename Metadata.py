@@ -4,6 +4,7 @@
 import json
 import os
 import subprocess
+import threading
 import typing
 
 from CompareResult import CompareResult, CompareResultStatus
@@ -12,8 +13,9 @@ ffprobeCommand = os.environ.get("TEST_FFPROBE_CMD", "ffprobe").split()
 
 
 class Metadata:
-    def __init__(self, mediaFile: str):
-        self._data = self._readStreamMetadata(mediaFile)
+    def __init__(self, mediaFile: str, data: typing.Any = None):
+        # data can be given to reuse the output of an earlier ffprobe run
+        self._data = data if data is not None else self._readStreamMetadata(mediaFile)
         self._mediaFile = mediaFile
 
     def __str__(self) -> str:
@@ -30,6 +32,7 @@ class Metadata:
             "-print_format",
             "json",
             "-show_streams",
+            "-show_format",
             mediaFile,
         ]
         result = subprocess.run(
@@ -45,6 +48,14 @@ class Metadata:
 
         return json.loads(result.stdout)
 
+    @property
+    def mediaFile(self) -> str:
+        return self._mediaFile
+
+    @property
+    def data(self) -> typing.Any:
+        return self._data
+
     @property
     def audioStreams(self) -> list[typing.Any]:
         return [
@@ -57,6 +68,70 @@ class Metadata:
             s for s in self._data.get("streams", []) if s.get("codec_type") == "video"
         ]
 
+    @property
+    def fps(self) -> float:
+        for stream in self.videoStreams:
+            for key in ["r_frame_rate", "avg_frame_rate"]:
+                rate = _parseRate(stream.get(key, ""))
+                if rate > 0:
+                    return rate
+        return 25.0
+
+    @property
+    def duration(self) -> float:
+        # in seconds, 0 if unknown
+        durations = [self._data.get("format", {}).get("duration")]
+        durations += [s.get("duration") for s in self._data.get("streams", [])]
+        for duration in durations:
+            try:
+                return float(duration)
+            except (TypeError, ValueError):
+                continue
+        return 0.0
+
+    @property
+    def frameCount(self) -> int:
+        for stream in self.videoStreams:
+            if str(stream.get("nb_frames", "")).isdigit():
+                return int(stream["nb_frames"])
+        return round(self.duration * self.fps)
+
+
+def _parseRate(rate: str) -> float:
+    # ffprobe reports rates as fractions like "30000/1001"
+    num, _, den = str(rate).partition("/")
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+_mediaInfo: dict[tuple[str, int], Metadata] = {}
+_mediaInfoLock = threading.Lock()
+
+
+def _mediaInfoKey(mediaFile: str) -> tuple[str, int]:
+    return (os.path.abspath(mediaFile), os.stat(mediaFile).st_mtime_ns)
+
+
+def mediaInfo(mediaFile: str) -> Metadata:
+    # Probe each file only once per run, the comparison and the report
+    # generation share the results.
+    key = _mediaInfoKey(mediaFile)
+    with _mediaInfoLock:
+        if key in _mediaInfo:
+            return _mediaInfo[key]
+
+    metadata = Metadata(mediaFile)
+    rememberMediaInfo(metadata)
+    return metadata
+
+
+def rememberMediaInfo(metadata: Metadata) -> None:
+    # make metadata from other sources (e.g. the ReferenceCache) available
+    with _mediaInfoLock:
+        _mediaInfo[_mediaInfoKey(metadata.mediaFile)] = metadata
+
 
 def compareMetadata(
     referenceMetadata: Metadata, lastRenderMetadata: Metadata
@@ -0,0 +1,140 @@
+# SPDX-FileCopyrightText: 2026 Kdenlive contributors
+# SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from functools import partial
+from pathlib import Path
+from typing import Iterable
+
+from audioCompare import AudioSource, FfmpegAudioReader, open_raw_audio
+from Metadata import Metadata, mediaInfo, rememberMediaInfo
+
+
+class ReferenceCache:
+    # Analysis results of the reference renders (ffprobe output and decoded
+    # audio), stored in one folder per reference named by its content hash.
+    # A changed reference gets a new hash and is analysed again.
+
+    def __init__(self, cacheFolder: Path):
+        self.cacheFolder = cacheFolder
+        self._hashes: dict[tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+
+        self.cacheFolder.mkdir(parents=True, exist_ok=True)
+
+    def _contentHash(self, referenceFile: str) -> str:
+        stat = os.stat(referenceFile)
+        hashKey = (os.path.abspath(referenceFile), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if hashKey in self._hashes:
+                return self._hashes[hashKey]
+
+        h = hashlib.sha256()
+        with open(referenceFile, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+
+        with self._lock:
+            self._hashes[hashKey] = digest
+        return digest
+
+    def _entryFolder(self, referenceFile: str) -> Path:
+        return self.cacheFolder / self._contentHash(referenceFile)
+
+    @staticmethod
+    def _tmpFile(targetFile: Path) -> Path:
+        return targetFile.with_name(f"{targetFile.name}.{threading.get_ident()}.tmp")
+
+    @staticmethod
+    def _publish(tmpFile: Path, targetFile: Path) -> None:
+        # Parallel comparisons may write the same entry, never expose
+        # partially written files. An existing file has the same content and
+        # is not replaced, it may be open for reading (which prevents
+        # replacing it on Windows).
+        try:
+            if targetFile.exists():
+                tmpFile.unlink()
+            else:
+                os.replace(tmpFile, targetFile)
+        except OSError:
+            tmpFile.unlink(missing_ok=True)
+
+    def _writeAtomic(self, targetFile: Path, content: bytes) -> None:
+        tmpFile = self._tmpFile(targetFile)
+        tmpFile.write_bytes(content)
+        self._publish(tmpFile, targetFile)
+
+    def metadata(self, referenceFile: str) -> Metadata:
+        entry = self._entryFolder(referenceFile)
+        metadataFile = entry / "metadata.json"
+        if metadataFile.is_file():
+            with open(metadataFile, "r") as f:
+                metadata = Metadata(referenceFile, json.load(f))
+            rememberMediaInfo(metadata)
+            return metadata
+
+        metadata = mediaInfo(referenceFile)
+        entry.mkdir(exist_ok=True)
+        self._writeAtomic(metadataFile, json.dumps(metadata.data).encode())
+        return metadata
+
+    def audioData(self, referenceFile: str, target_rate: int = 44100) -> AudioSource:
+        # The decoded samples are stored without header and read in chunks
+        # during the comparison, they are never loaded completely.
+        entry = self._entryFolder(referenceFile)
+        samplesFile = entry / f"audio-{target_rate}.pcm"
+        infoFile = entry / f"audio-{target_rate}.json"
+        if not samplesFile.is_file() or not infoFile.is_file():
+            entry.mkdir(exist_ok=True)
+            tmpFile = self._tmpFile(samplesFile)
+            try:
+                with FfmpegAudioReader(referenceFile, target_rate) as reader:
+                    with open(tmpFile, "wb") as f:
+                        while True:
+                            samples = reader.read(reader.rate)
+                            f.write(samples.tobytes())
+                            if len(samples) < reader.rate * reader.channels:
+                                break
+            except Exception:
+                tmpFile.unlink(missing_ok=True)
+                raise
+            self._publish(tmpFile, samplesFile)
+            info = {
+                "rate": reader.rate,
+                "width": reader.width,
+                "channels": reader.channels,
+            }
+            self._writeAtomic(infoFile, json.dumps(info).encode())
+
+        with open(infoFile, "r") as f:
+            info = json.load(f)
+        return partial(
+            open_raw_audio, samplesFile, info["rate"], info["width"], info["channels"]
+        )
+
+    def prewarm(self, referenceFiles: Iterable[str]) -> None:
+        for referenceFile in referenceFiles:
+            print(f"Analysing reference: {referenceFile}", flush=True)
+            try:
+                metadata = self.metadata(referenceFile)
+                if len(metadata.audioStreams) > 0:
+                    self.audioData(referenceFile)
+            except Exception as err:
+                print(f"Analysing {referenceFile} failed: {err}", flush=True)
+
+    def prune(self, referenceFiles: Iterable[str]) -> None:
+        # remove the entries of references that changed or no longer exist
+        validEntries = {self._contentHash(f) for f in referenceFiles}
+        for entry in self.cacheFolder.iterdir():
+            if entry.name not in validEntries:
+                print(f"Removing outdated reference cache entry: {entry.name}")
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                # samples stored as .npy by earlier versions
+                for samplesFile in entry.glob("audio-*.npy"):
+                    samplesFile.unlink(missing_ok=True)
@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: 2026 Kdenlive contributors
+# SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Optional
+from xml.dom.minidom import Text, parse
+from xml.parsers import expat
+
+from RenderProject import RenderProject
+
+
+class RenderCache:
+    # properties in Kdenlive projects that reference external files
+    assetProperties = ["resource", "kdenlive:originalurl", "luma", "av.file"]
+
+    def __init__(self, cacheFolder: Path, maxSize: int, buildInfo: str):
+        self.cacheFolder = cacheFolder
+        self.maxSize = maxSize
+        self.buildInfo = buildInfo
+        self._fileHashes: dict[Path, str] = {}
+        self._lock = threading.Lock()
+
+        self.cacheFolder.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def buildInfoFromComponents(componentsFile: Path) -> Optional[str]:
+        # Versions of Kdenlive, MLT and their dependencies as written by
+        # kdenlive --setup-report
+        try:
+            with open(componentsFile, mode="r", encoding="utf-8") as read_file:
+                data = json.load(read_file)
+        except (OSError, ValueError):
+            return None
+
+        components = sorted(
+            f"{item.get('name')}:{item.get('version')}"
+            for item in data.get("components", [])
+        )
+        if not components:
+            return None
+
+        return ";".join(components + [f"packageType:{data.get('packageType')}"])
+
+    def _fileHash(self, path: Path) -> str:
+        with self._lock:
+            if path in self._fileHashes:
+                return self._fileHashes[path]
+
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+
+        with self._lock:
+            self._fileHashes[path] = digest
+        return digest
+
+    def _projectAssets(self, project: RenderProject) -> list[Path]:
+        try:
+            document = parse(str(project.projectPath))
+        except expat.ExpatError:
+            return []
+
+        # the MLT root is empty, so paths are relative to the project file
+        projectDir = project.projectPath.parent
+        assets: set[Path] = set()
+        for prop in document.getElementsByTagName("property"):
+            if prop.getAttribute("name") not in self.assetProperties:
+                continue
+            if not isinstance(prop.firstChild, Text) or not prop.firstChild.data:
+                continue
+            assetPath = projectDir / prop.firstChild.data.strip()
+            if assetPath.is_file():
+                assets.add(assetPath.resolve())
+
+        return sorted(assets)
+
+    def key(self, project: RenderProject) -> str:
+        h = hashlib.sha256()
+        h.update(self.buildInfo.encode())
+        h.update(f"{project.propRenderProfile}:{project.renderFilename}".encode())
+        h.update(self._fileHash(project.projectPath).encode())
+        for asset in self._projectAssets(project):
+            h.update(f"{asset.name}:{self._fileHash(asset)}".encode())
+        return h.hexdigest()
+
+    def _entryPath(self, key: str, renderFile: Path) -> Path:
+        return self.cacheFolder / f"{key}{renderFile.suffix}"
+
+    def restore(self, key: str, renderFile: Path) -> bool:
+        entry = self._entryPath(key, renderFile)
+        with self._lock:
+            if not entry.is_file():
+                return False
+            # mark the entry as recently used for the eviction
+            os.utime(entry)
+            shutil.copyfile(entry, renderFile)
+        return True
+
+    def store(self, key: str, renderFile: Path) -> None:
+        entry = self._entryPath(key, renderFile)
+        tmpEntry = entry.with_name(entry.name + ".tmp")
+        shutil.copyfile(renderFile, tmpEntry)
+        with self._lock:
+            os.replace(tmpEntry, entry)
+            self._evict()
+
+    def _evict(self) -> None:
+        # remove least recently used entries until the cache fits into maxSize
+        entries = sorted(
+            # skip temporary files of entries that are still being stored
+            (p for p in self.cacheFolder.iterdir() if p.suffix != ".tmp"),
+            key=lambda p: p.stat().st_mtime,
+        )
+        totalSize = sum(p.stat().st_size for p in entries)
+        for entry in entries:
+            if totalSize <= self.maxSize:
+                break
+            totalSize -= entry.stat().st_size
+            print(f"Evicting render cache entry: {entry.name}", flush=True)
+            entry.unlink(missing_ok=True)
@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: 2026 Kdenlive contributors
+# SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
+
+import os
+from pathlib import Path
+
+
+class RenderLog:
+    # Output of a render process. The process writes directly into logFile,
+    # only the last tailLines lines are kept in memory for the reports.
+
+    def __init__(self, logFile: Path, tailLines: int = 200):
+        self.logFile = logFile
+        self.tailLines = tailLines
+        self.tail: list[str] = []
+        # position of the first tail line in the file
+        self._tailOffset = 0
+
+    def __str__(self) -> str:
+        return "".join(self.tail)
+
+    @property
+    def empty(self) -> bool:
+        return not self.logFile.is_file() or self.logFile.stat().st_size == 0
+
+    def loadTail(self) -> None:
+        # read the file backwards until enough lines are found
+        with open(self.logFile, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            chunks: list[bytes] = []
+            newlines = 0
+            while position > 0 and newlines <= self.tailLines:
+                size = min(64 * 1024, position)
+                position -= size
+                f.seek(position)
+                chunks.insert(0, f.read(size))
+                newlines += chunks[0].count(b"\n")
+
+        lines = b"".join(chunks).splitlines(keepends=True)
+        if position > 0:
+            # the first line may be incomplete
+            lines = lines[1:]
+        lines = lines[-self.tailLines :] if self.tailLines > 0 else []
+
+        self._tailOffset = end - sum(len(line) for line in lines)
+        self.tail = [line.decode("utf-8", errors="replace") for line in lines]
+
+    def excerpt(self, headLines: int) -> str:
+        # the first headLines lines and the tail, or the whole log if both
+        # overlap
+        head: list[bytes] = []
+        with open(self.logFile, "rb") as f:
+            for _ in range(headLines):
+                line = f.readline()
+                if not line:
+                    break
+                head += [line]
+            headEnd = f.tell()
+            if headEnd >= self._tailOffset:
+                return (b"".join(head) + f.read()).decode("utf-8", errors="replace")
+
+        return (
+            b"".join(head).decode("utf-8", errors="replace")
+            + f"[... truncated, full log: {self.logFile} ...]\n"
+            + str(self)
+        )
@@ -3,12 +3,22 @@
 # SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
 
 import platform
+from fractions import Fraction
 from pathlib import Path
 from typing import Optional
 from xml.dom.minidom import Text, parse
 from xml.parsers import expat
 
-from Config import AVType, ExceptionConfig, ExceptionType, ProjectConfig
+from Config import (
+    AVType,
+    ExceptionConfig,
+    ExceptionType,
+    MetricConfig,
+    MetricType,
+    ProjectConfig,
+)
+from RenderLog import RenderLog
+from Timing import PhaseTimings
 
 
 class RenderProject:
@@ -29,6 +39,14 @@ class RenderProject:
             "exceptions"
         )
 
+        # video metrics and thresholds used for the comparison
+        self.metrics: Optional[list[MetricConfig]] = projectConfig.get("metrics")
+        for metric in self.metrics or []:
+            if metric.get("type") not in list(MetricType):
+                raise Exception(
+                    f"Unknown video metric {metric.get('type')!r} for {projectPath}!"
+                )
+
         self.propRenderProfile: Optional[str] = None
         self.propRenderUrl: Optional[str] = None
 
@@ -39,15 +57,17 @@ class RenderProject:
         ) = self._extractRenderInfo()
 
         self.renderOutputMissing = False
-        self.renderLog: Optional[str] = None
-        self.renderErrorLog: Optional[str] = None
+        self.renderCached = False
+        self.timings = PhaseTimings()
+        self.renderLog: Optional[RenderLog] = None
+        self.renderErrorLog: Optional[RenderLog] = None
 
-    def _extractRenderInfo(self) -> tuple[str, str, int]:
+    def _extractRenderInfo(self) -> tuple[str, str, Fraction]:
         try:
             document = parse(str(self.projectPath))
         except expat.ExpatError:
             print(f"Invalid project file in folder: {self.projectPath}")
-            return ("", "", -1)
+            return ("", "", Fraction(-1))
         pl = document.getElementsByTagName("playlist")
         renderProfile = ""
         renderUrl = ""
@@ -69,12 +89,16 @@ class RenderProject:
 
         pr = document.getElementsByTagName("profile")
 
-        fps = 25
+        fps = Fraction(25)
         if pr:
-            fps = int(pr[0].getAttribute("frame_rate_num"))
+            # e.g. 30000/1001 for 29.97 fps
+            fps = Fraction(
+                int(pr[0].getAttribute("frame_rate_num")),
+                int(pr[0].getAttribute("frame_rate_den") or 1),
+            )
 
         if not fps:
-            fps = 25
+            fps = Fraction(25)
 
         # print("GOT PROFILE INFO:", renderProfile, " = ", renderUrl, flush=True)
         return (renderProfile, renderUrl, fps)
@@ -2,23 +2,33 @@
 # SPDX-FileCopyrightText: 2024 Julius Künzel <julius.kuenzel@kde.org>
 # SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
 
+import io
+import json
 import os
+import re
 import socket
 import subprocess
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from pathlib import Path
-from xml.dom.minidom import Document
+from typing import IO, Iterator, Optional
+from xml.sax.saxutils import XMLGenerator
+from xml.sax.xmlreader import AttributesImpl
 
 from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageOps
 
 from CompareResult import CompareResult, CompareResultStatus
+from Metadata import mediaInfo
+from RenderLog import RenderLog
 from RenderProject import RenderProject
 
 # class ProjectResult():
 #     def __init__(self):
 ffmpegCommand = os.environ.get("TEST_FFMPEG_CMD", "ffmpeg").split()
 
+# control characters (e.g. terminal escapes in render logs) are not allowed in XML
+invalidXmlChars = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
 
 class ResultSummary:
     freeMonoFontFile = Path(__file__).parent / "fonts/freemono/FreeMono.ttf"
@@ -141,89 +151,195 @@ class ResultSummary:
         self.projectResults = projectResults
         self.renderFolder = renderFolder
         self.referenceFolder = referenceFolder
-        self._tempFiles: list[Path] = []
-
-    def _celanupTempFile(self) -> None:
-        for filePath in self._tempFiles:
-            filePath.unlink(missing_ok=True)
-        self._tempFiles = []
-
-    @staticmethod
-    def _getFps(filename: Path) -> float:
-        fps = 25.0
-        cmd3 = ffmpegCommand + ["-hide_banner", "-i", str(filename)]
-        proc3 = subprocess.Popen(
-            cmd3,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            universal_newlines=True,
+        self.slowestCount = 10
+        # number of projects processed in parallel when creating the report
+        self.jobs = 1
+        # create comparison images for broken video frames
+        self.thumbnails = True
+        # encoding of the comparison images
+        self.thumbnailFormat = "png"
+        self.thumbnailQuality = 85
+        self.thumbnailScale = 1.0
+        # keep the images of the first error range of a project unscaled
+        self.thumbnailFullResFirstRange = False
+        # maximum number of error ranges with images per project, 0 means
+        # unlimited
+        self.thumbnailMaxRanges = 20
+        # maximum size in bytes of all comparison images, 0 means unlimited
+        self.thumbnailBudget = 0
+        self._thumbnailBudgetExceeded = False
+        # number of first render log lines in the JUnit report, the last
+        # lines are kept by the RenderLog
+        self.junitLogHeadLines = 100
+
+    def _missingThumbnail(self) -> Image.Image:
+        resultImage = Image.new(mode="RGB", size=(800, 450))
+        myFont = ImageFont.truetype(str(self.freeMonoFontFile), 48)
+        I1 = ImageDraw.Draw(resultImage)
+        I1.text(
+            (10, 2),
+            "Could not create thumbnail",
+            font=myFont,
+            fill="white",
+            stroke_width=2,
+            stroke_fill="white",
         )
+        return resultImage
 
-        if not proc3.stderr:
-            return fps
-
-        for line in proc3.stderr:
-            linestr = line.strip()
-            if "Stream #" in linestr and "Video:" in linestr:
-                # match
-                vals = linestr.split(",")
-                for v in vals:
-                    if " tbr" in v:
-                        fps = float(v.split(" ")[1])
-                        break
-        proc3.wait()
-        return fps
-
-    def _extractFrameToImage(
-        self, videoFile: Path, frame: int, fps: float
-    ) -> Image.Image:
-        imageFile = f"tmp/{time.time()}.png"
-        self._tempFiles += [Path(imageFile)]
+    @staticmethod
+    def _readPpmFrame(stream: IO[bytes]) -> Optional[Image.Image]:
+        # ffmpeg writes each frame as "P6\n<width> <height>\n255\n" followed
+        # by the raw rgb24 pixels
+        if stream.readline().strip() != b"P6":
+            return None
+        try:
+            width, height = (int(v) for v in stream.readline().split())
+            stream.readline()
+        except ValueError:
+            return None
+
+        data = stream.read(width * height * 3)
+        if len(data) < width * height * 3:
+            return None
+
+        return Image.frombuffer("RGB", (width, height), data, "raw", "RGB", 0, 1)
+
+    def _extractFrames(
+        self, videoFile: Path, frameNumbers: list[int]
+    ) -> Iterator[Image.Image]:
+        # Yield the given (sorted) frames, extracted with a single decode of
+        # the file and passed as raw pixels through a pipe without any files.
+        # The frames are selected by number, so unlike seeking by time this
+        # does not need the frame rate of the file.
+        selection = "+".join(f"eq(n\\,{frame})" for frame in frameNumbers)
         cmd = ffmpegCommand + [
             "-hide_banner",
             "-loglevel",
             "error",
-            "-y",
-            "-ss",
-            str(frame / fps),
             "-i",
             str(videoFile),
+            "-vf",
+            f"select={selection}",
+            "-fps_mode",
+            "passthrough",
             "-frames:v",
-            "1",
-            imageFile,
+            str(len(frameNumbers)),
+            "-c:v",
+            "ppm",
+            "-f",
+            "image2pipe",
+            "-",
         ]
-        subprocess.call(cmd)
-        if Path(imageFile).is_file():
-            return Image.open(imageFile)
-        else:
-            resultImage = Image.new(mode="RGB", size=(800, 450))
-            myFont = ImageFont.truetype(str(self.freeMonoFontFile), 48)
-            I1 = ImageDraw.Draw(resultImage)
-            I1.text(
-                (10, 2),
-                "Could not create thumbnail",
-                font=myFont,
-                fill="white",
-                stroke_width=2,
-                stroke_fill="white",
-            )
-            return resultImage
+
+        extracted = 0
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as process:
+            assert process.stdout
+            while extracted < len(frameNumbers):
+                image = self._readPpmFrame(process.stdout)
+                if not image:
+                    break
+                extracted += 1
+                yield image
+
+        # frames beyond the end of the video are missing at the end
+        for _ in range(extracted, len(frameNumbers)):
+            yield self._missingThumbnail()
+
+    def _sampleErrorRanges(self, result: CompareResult) -> list[int]:
+        # Indexes of the error ranges that get comparison images. Above the
+        # limit the first, the worst and the last range are kept and the
+        # remaining slots are spread evenly over the other ranges.
+        count = len(result.videoErrors)
+        limit = self.thumbnailMaxRanges
+        if limit <= 0 or count <= limit:
+            return list(range(count))
+
+        priority = [0]
+        if len(result.videoErrorMse) == count:
+            priority += [max(range(count), key=lambda i: result.videoErrorMse[i])]
+        priority += [count - 1]
+        selected = set(list(dict.fromkeys(priority))[:limit])
+
+        # spread over the ranges that are not selected yet, so every slot is
+        # used, there are more remaining ranges than slots
+        remaining = [i for i in range(count) if i not in selected]
+        slots = limit - len(selected)
+        for i in range(slots):
+            selected.add(remaining[(2 * i + 1) * len(remaining) // (2 * slots)])
+
+        return sorted(selected)
+
+    def _projectImages(
+        self, project: RenderProject, result: CompareResult, index: int
+    ) -> dict[int, str]:
+        if (
+            not self.thumbnails
+            or result.status != CompareResultStatus.CONTENT_COMPARE_FAILURE
+        ):
+            return {}
+        return self._createComparisonImages(project, result, index)
+
+    def _createComparisonImages(
+        self, project: RenderProject, result: CompareResult, index: int
+    ) -> dict[int, str]:
+        # comparison images for the first and last frame of the sampled error
+        # ranges, returns the image file names by frame
+        frames: list[int] = []
+        for rangeIndex in self._sampleErrorRanges(result):
+            frameRange = result.videoErrors[rangeIndex]
+            frames += [frameRange[0] - 1]
+            if frameRange[1] - frameRange[0] >= 2:
+                frames += [frameRange[1] - 1]
+        if not frames:
+            return {}
+
+        referenceVideo = Path(self.referenceFolder) / project.renderFilename
+        renderVideo = Path(self.renderFolder) / project.renderFilename
+
+        # the first error range can start at frame 0
+        frameNumbers = sorted({max(frame, 0) for frame in frames})
+        firstRange = result.videoErrors[0]
+        firstRangeFrames = {firstRange[0] - 1, firstRange[1] - 1}
+
+        imageNames: dict[int, str] = {}
+        with project.timings.measure("thumbnails"):
+            # both files are decoded side by side, so only one pair of frames
+            # is kept in memory
+            for frameNumber, img1, img2 in zip(
+                frameNumbers,
+                self._extractFrames(referenceVideo, frameNumbers),
+                self._extractFrames(renderVideo, frameNumbers),
+            ):
+                for frame in {f for f in frames if max(f, 0) == frameNumber}:
+                    comparisonImage = self._constructComparisonImage(
+                        referenceVideo,
+                        renderVideo,
+                        frame,
+                        img1,
+                        img2,
+                        result.videoErrors,
+                        result.framesDuration,
+                    )
+                    imageNames[frame] = self._saveThumbnail(
+                        comparisonImage,
+                        f"tmp/{index}-{frame}-result",
+                        self.thumbnailFullResFirstRange and frame in firstRangeFrames,
+                    )
+
+        return imageNames
 
     def _constructComparisonImage(
         self,
         referenceVideoFile: Path,
         renderVideoFile: Path,
         frame: int,
-        fps: float,
+        img1: Image.Image,
+        img2: Image.Image,
         errors: list[tuple[int, int]],
         length: int,
     ) -> Image.Image:
         borderWidth = 10
 
-        img1 = self._extractFrameToImage(referenceVideoFile, frame, fps)
-        img2 = self._extractFrameToImage(renderVideoFile, frame, fps)
-
         diff = ImageChops.difference(img1, img2)
 
         images = [img1, img2]
@@ -300,10 +416,86 @@ class ResultSummary:
             new_im.paste(img, (x_offset, diffHeight))
             x_offset += im.size[0] + 2 * borderWidth
 
-        self._celanupTempFile()
-
         return new_im
 
+    def _saveThumbnail(self, image: Image.Image, baseName: str, fullRes: bool) -> str:
+        # returns the file name
+        if self.thumbnailScale != 1.0 and not fullRes:
+            width, height = image.size
+            image = image.resize(
+                (
+                    max(1, int(width * self.thumbnailScale)),
+                    max(1, int(height * self.thumbnailScale)),
+                ),
+                Image.Resampling.LANCZOS,
+            )
+
+        imageFormat = self.thumbnailFormat.lower()
+        if imageFormat == "webp" and ".webp" not in Image.registered_extensions():
+            imageFormat = "jpeg"
+
+        buffer = io.BytesIO()
+        if imageFormat == "png":
+            image.save(buffer, format="png")
+        else:
+            image.save(buffer, format=imageFormat, quality=self.thumbnailQuality)
+        content = buffer.getvalue()
+
+        extension = "jpg" if imageFormat == "jpeg" else imageFormat
+        imageName = f"{baseName}.{extension}"
+        with open(imageName, "wb") as f:
+            f.write(content)
+
+        return imageName
+
+    def _applyThumbnailBudget(self, projectImages: list[dict[int, str]]) -> None:
+        # The images are created in parallel, the budget is applied afterwards
+        # in the order of the projects and frames so the same images are kept
+        # in every run. Images that do not fit are deleted.
+        if self.thumbnailBudget <= 0:
+            return
+
+        totalBytes = 0
+        for imageNames in projectImages:
+            for frame in sorted(imageNames):
+                size = os.path.getsize(imageNames[frame])
+                if totalBytes + size > self.thumbnailBudget:
+                    self._thumbnailBudgetExceeded = True
+                    os.remove(imageNames.pop(frame))
+                else:
+                    totalBytes += size
+
+    @staticmethod
+    def _mediaInfoHtml(label: str, mediaFile: Path) -> str:
+        # the file was already probed during the comparison
+        if not mediaFile.is_file():
+            return ""
+        try:
+            metadata = mediaInfo(str(mediaFile))
+        except Exception:
+            return ""
+
+        details: list[str] = []
+        if metadata.videoStreams:
+            stream = metadata.videoStreams[0]
+            if "width" in stream and "height" in stream:
+                details += [f"{stream['width']}x{stream['height']}"]
+            details += [f"{metadata.fps:.2f} fps", f"{metadata.frameCount} frames"]
+        details += [f"{metadata.duration:.2f}s"]
+        details += [f"{len(metadata.audioStreams)} audio stream(s)"]
+        return f"<b>{label}: </b>{', '.join(details)}</br>"
+
+    @staticmethod
+    def _errorFrameHtml(frame: int, imageNames: dict[int, str]) -> str:
+        if frame not in imageNames:
+            return f"{frame}"
+
+        return f"""
+        <a href="javascript:void(0)" onclick="toggleImg0('{imageNames[frame]}')">
+            {frame}
+        </a>
+        """
+
     def __str__(self) -> str:
         string = ["==== SUMMARY ===="]
         for item in self.projectResults:
@@ -314,9 +506,40 @@ class ResultSummary:
             suffix = " (FAILURE ALLOWED)" if failureAllowed else ""
             string += [f"{result.statusString}\t - {project.name}{suffix}"]
 
+        if self.slowestCount > 0:
+            string += [self._slowestSummary()]
+
+        return "\n".join(string)
+
+    def _slowestSummary(self) -> str:
+        projects = [project for project, _ in self.projectResults]
+        slowestProjects = sorted(projects, key=lambda p: p.timings.total, reverse=True)
+        string = [f"==== SLOWEST {self.slowestCount} PROJECTS ===="]
+        for project in slowestProjects[: self.slowestCount]:
+            string += [
+                f"{project.timings.total:8.2f}s - {project.name} ({project.timings})"
+            ]
+
+        slowestPhases = sorted(
+            (
+                (seconds, phase, project.name)
+                for project in projects
+                for phase, seconds in project.timings.phases.items()
+            ),
+            reverse=True,
+        )
+        string += [f"==== SLOWEST {self.slowestCount} PHASES ===="]
+        for seconds, phase, name in slowestPhases[: self.slowestCount]:
+            string += [f"{seconds:8.2f}s - {phase:<15} {name}"]
+
         return "\n".join(string)
 
-    def _itemHtml(self, item: tuple[RenderProject, CompareResult], index: int) -> str:
+    def _itemHtml(
+        self,
+        item: tuple[RenderProject, CompareResult],
+        index: int,
+        imageNames: dict[int, str],
+    ) -> str:
         project, result = item
         collapsible = ""
 
@@ -327,33 +550,28 @@ class ResultSummary:
         if project.description:
             collapsible += project.description + "</br>"
 
-        if result.status == CompareResultStatus.CONTENT_COMPARE_FAILURE:
-            referenceVideo = Path(self.referenceFolder) / project.renderFilename
-            fps = self._getFps(referenceVideo)
-            renderVideo = Path(self.renderFolder) / project.renderFilename
+        collapsible += self._mediaInfoHtml(
+            "Reference", Path(self.referenceFolder) / project.renderFilename
+        )
+        collapsible += self._mediaInfoHtml(
+            "Render", Path(self.renderFolder) / project.renderFilename
+        )
 
+        if result.videoMetrics:
+            collapsible += "<b>Video metrics: </b>"
+            collapsible += ", ".join(
+                f"{name}: {value:.4f}" for name, value in result.videoMetrics.items()
+            )
+            collapsible += "</br>"
+
+        if result.status == CompareResultStatus.CONTENT_COMPARE_FAILURE:
             collapsible += "<b>Broken video frames: </b>"
             if not result.videoErrors:
                 collapsible += "None"
             for frameRange in result.videoErrors:
                 errorPos = frameRange[0] - 1
 
-                comparisonImage = self._constructComparisonImage(
-                    referenceVideo,
-                    renderVideo,
-                    errorPos,
-                    fps,
-                    result.videoErrors,
-                    result.framesDuration,
-                )
-                imageName = f"tmp/{index}-{errorPos}-result.png"
-                comparisonImage.save(imageName)
-
-                collapsible += f"""
-                <a href="javascript:void(0)" onclick="toggleImg0('{imageName}')">
-                    {errorPos}
-                </a>
-                """
+                collapsible += self._errorFrameHtml(errorPos, imageNames)
 
                 if frameRange[1] - frameRange[0] < 2:
                     collapsible += " | "
@@ -362,22 +580,18 @@ class ResultSummary:
                     # Second image
                     errorPos = frameRange[1] - 1
 
-                    comparisonImage = self._constructComparisonImage(
-                        referenceVideo,
-                        renderVideo,
-                        errorPos,
-                        fps,
-                        result.videoErrors,
-                        result.framesDuration,
-                    )
-                    imageName = f"tmp/{index}-{errorPos}-result.png"
-                    comparisonImage.save(imageName)
+                    collapsible += self._errorFrameHtml(errorPos, imageNames)
+                    collapsible += " | "
 
-                    collapsible += f"""
-                    <a href="javascript:void(0)" onclick="toggleImg0('{imageName}')">
-                        {errorPos}
-                    </a> |
-                    """
+            if self.thumbnails:
+                skippedRanges = len(result.videoErrors) - len(
+                    self._sampleErrorRanges(result)
+                )
+                if skippedRanges > 0:
+                    collapsible += (
+                        f"</br><i>{skippedRanges} more ranges not rendered"
+                        " as comparison images.</i>"
+                    )
 
             collapsible += "</br><b>Broken audio frames: </b>"
             if not result.audioErrors:
@@ -412,13 +626,17 @@ class ResultSummary:
         if failureAllowed:
             collapsible += "<p><b>Note:</b> This test is allowed to fail.</p>"
 
+        if project.renderCached:
+            collapsible += "<p><b>Note:</b> The render was restored from the cache.</p>"
+
+        cachedSuffix = " (cached render)" if project.renderCached else ""
         collapsibleClass = "lbl-toogle-exists" if collapsible else ""
         html = f"""
         <input id="collapsible{index}" class="toggle" type="checkbox">
         <label for="collapsible{index}" class="lbl-toggle lbl-toggle-{status} {collapsibleClass}">
             <div class="centered">
                 <img src="resources/{icon}" />
-                Test #{index} for file <b>{project.renderFilename}</b>: {result.message}.
+                Test #{index} for file <b>{project.renderFilename}</b>{cachedSuffix}: {result.message}.
             </div>
         </label>
         """
@@ -435,9 +653,7 @@ class ResultSummary:
         return html
 
     def toHtml(self) -> str:
-        body = ""
         print("Reading JSON")
-        import json
 
         kdenliveSetup = "No components info"
         if os.path.exists("components.json"):
@@ -453,11 +669,32 @@ class ResultSummary:
 
         print("Creating HTML")
         size = len(self.projectResults)
-        for ix, item in enumerate(self.projectResults):
-            print(f"Processing result {ix + 1} of {size}", end="\r")
-            body += self._itemHtml(item, ix + 1)
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as pool:
+            futures = [
+                pool.submit(self._projectImages, project, result, ix + 1)
+                for ix, (project, result) in enumerate(self.projectResults)
+            ]
+            for ix, _ in enumerate(as_completed(futures)):
+                print(f"Processing result {ix + 1} of {size}", end="\r")
+            # keep the order of the projects
+            projectImages = [future.result() for future in futures]
         print()
 
+        self._applyThumbnailBudget(projectImages)
+        body = "".join(
+            self._itemHtml(item, ix + 1, imageNames)
+            for ix, (item, imageNames) in enumerate(
+                zip(self.projectResults, projectImages)
+            )
+        )
+
+        budgetNote = ""
+        if self._thumbnailBudgetExceeded:
+            budgetNote = (
+                "<p><b>Note:</b> The size budget for comparison images was"
+                " exhausted, some broken frames have no image.</p>"
+            )
+
         return f"""
         <!DOCTYPE html>
             <head>
@@ -475,6 +712,7 @@ class ResultSummary:
                     </div>
                     <div class="split left">
                         <h2>Tests done on {datetime.now().ctime()}<br/>{kdenliveSetup}</h2>
+                        {budgetNote}
                         {body}
                     </div>
                 </div>
@@ -482,82 +720,139 @@ class ResultSummary:
         </html>
         """
 
-    def saveJUnitToFile(self, outputFile: Path) -> None:
-        root = Document()
-        root.toprettyxml(encoding="utf-8")
+    def _writeJUnitLog(self, xml: XMLGenerator, element: str, log: RenderLog) -> None:
+        content = log.excerpt(self.junitLogHeadLines)
+        if element == "system-out":
+            # shown as a link to the job artifact by GitLab
+            content += f"\n[[ATTACHMENT|{log.logFile}]]\n"
+
+        xml.ignorableWhitespace("\n\t\t\t")
+        xml.startElement(element, AttributesImpl({}))
+        xml.characters(invalidXmlChars.sub("", content))
+        xml.endElement(element)
+
+    def _writeJUnitTestCase(
+        self, xml: XMLGenerator, project: RenderProject, result: CompareResult
+    ) -> None:
+        xml.ignorableWhitespace("\n\t\t")
+        xml.startElement(
+            "testcase",
+            AttributesImpl(
+                {
+                    "classname": f"project.{project.name}",
+                    "name": project.name,
+                    "time": f"{project.timings.total:.2f}",
+                }
+            ),
+        )
 
-        suites = root.createElement("testsuites")
-        root.appendChild(suites)
+        properties = {
+            f"metric.{name}": f"{value:.4f}"
+            for name, value in result.videoMetrics.items()
+        }
+        if project.renderCached:
+            properties["cached"] = "true"
+        if properties:
+            xml.ignorableWhitespace("\n\t\t\t")
+            xml.startElement("properties", AttributesImpl({}))
+            for name, value in properties.items():
+                xml.startElement(
+                    "property", AttributesImpl({"name": name, "value": value})
+                )
+                xml.endElement("property")
+            xml.endElement("properties")
 
-        suite = root.createElement("testsuite")
-        suites.appendChild(suite)
+        if result.status == CompareResultStatus.CONTENT_COMPARE_FAILURE:
+            message = "Video comparison failed in the following ranges:"
+            if not result.videoErrors:
+                message += " None"
+            for frameRange in result.videoErrors:
+                message += f"\n - frame {frameRange[0]} - {frameRange[1]}"
+            message += "\nAudio comparison failed in the following ranges:"
+            if not result.audioErrors:
+                message += " None"
+            for frameRange in result.audioErrors:
+                message += f"\n - frame {frameRange[0]} - {frameRange[1]}"
 
-        failed_count = 0
-        error_count = 0
+            xml.ignorableWhitespace("\n\t\t\t")
+            xml.startElement("failure", AttributesImpl({"message": result.message}))
+            xml.characters(invalidXmlChars.sub("", message))
+            xml.endElement("failure")
 
-        for item in self.projectResults:
-            project, result = item
+        elif result.status != CompareResultStatus.SUCCESS:
+            xml.ignorableWhitespace("\n\t\t\t")
+            xml.startElement("error", AttributesImpl({"message": result.message}))
+            details = result.errorDetails if result.errorDetails else result.message
+            xml.characters(invalidXmlChars.sub("", details))
+            xml.endElement("error")
 
-            case = root.createElement("testcase")
-            case.setAttribute("classname", f"project.{project.name}")
-            case.setAttribute("name", project.name)
-            case.setAttribute("time", "0.00")
-            suite.appendChild(case)
+        if project.renderLog and not project.renderLog.empty:
+            self._writeJUnitLog(xml, "system-out", project.renderLog)
 
-            if result.status == CompareResultStatus.CONTENT_COMPARE_FAILURE:
-                failure = root.createElement("failure")
-                failure.setAttribute("message", result.message)
-                case.appendChild(failure)
-                failed_count += 1
-
-                message = "Video comparison failed in the following ranges:"
-                if not result.videoErrors:
-                    message += " None"
-                for frameRange in result.videoErrors:
-                    message += f"\n - frame {frameRange[0]} - {frameRange[1]}"
-                message += "\nAudio comparison failed in the following ranges:"
-                if not result.audioErrors:
-                    message += " None"
-                for frameRange in result.audioErrors:
-                    message += f"\n - frame {frameRange[0]} - {frameRange[1]}"
-                failure_details = root.createTextNode(message)
-                failure.appendChild(failure_details)
+        if project.renderErrorLog and not project.renderErrorLog.empty:
+            self._writeJUnitLog(xml, "system-err", project.renderErrorLog)
 
+        xml.ignorableWhitespace("\n\t\t")
+        xml.endElement("testcase")
+
+    def saveJUnitToFile(self, outputFile: Path) -> None:
+        # The test cases are streamed into the file one by one, long render
+        # logs are truncated and link to the full log files.
+        failedCount = 0
+        errorCount = 0
+        for _, result in self.projectResults:
+            if result.status == CompareResultStatus.CONTENT_COMPARE_FAILURE:
+                failedCount += 1
             elif result.status != CompareResultStatus.SUCCESS:
-                error = root.createElement("error")
-                error.setAttribute("message", result.message)
-                case.appendChild(error)
-                error_count += 1
+                errorCount += 1
+        totalTime = sum(project.timings.total for project, _ in self.projectResults)
+
+        with open(outputFile, "w", encoding="utf-8") as f:
+            xml = XMLGenerator(f, "utf-8", short_empty_elements=True)
+            xml.startDocument()
+            xml.startElement("testsuites", AttributesImpl({}))
+            xml.ignorableWhitespace("\n\t")
+            xml.startElement(
+                "testsuite",
+                AttributesImpl(
+                    {
+                        "name": "kdenlive",
+                        "errors": str(errorCount),
+                        "failures": str(failedCount),
+                        "time": f"{totalTime:.2f}",
+                        "timestamp": datetime.now(tz=timezone.utc).isoformat(),
+                        "hostname": socket.gethostname(),
+                    }
+                ),
+            )
 
-                error_details = root.createTextNode(
-                    result.errorDetails if result.errorDetails else result.message
-                )
-                error.appendChild(error_details)
-
-            if project.renderLog:
-                stdout = root.createElement("system-out")
-                stdout_content = root.createTextNode(project.renderLog)
-                stdout.appendChild(stdout_content)
-                case.appendChild(stdout)
-
-            if project.renderErrorLog:
-                stderr = root.createElement("system-err")
-                stderr_content = root.createTextNode(project.renderErrorLog)
-                stderr.appendChild(stderr_content)
-                case.appendChild(stderr)
-
-        suite.setAttribute("name", "kdenlive")
-        suite.setAttribute("errors", str(error_count))
-        suite.setAttribute("failures", str(failed_count))
-        suite.setAttribute("time", "0.00")
-        timestamp = datetime.now(tz=timezone.utc).isoformat()
-        suite.setAttribute("timestamp", timestamp)
-        suite.setAttribute("hostname", socket.gethostname())
-
-        xml_str = root.toprettyxml(indent="\t")
+            for project, result in self.projectResults:
+                self._writeJUnitTestCase(xml, project, result)
+
+            xml.ignorableWhitespace("\n\t")
+            xml.endElement("testsuite")
+            xml.ignorableWhitespace("\n")
+            xml.endElement("testsuites")
+            xml.ignorableWhitespace("\n")
+            xml.endDocument()
+
+    def saveTimingsToFile(self, outputFile: Path) -> None:
+        timings = {
+            "projects": [
+                {
+                    "name": project.name,
+                    "total": round(project.timings.total, 3),
+                    "phases": {
+                        phase: round(seconds, 3)
+                        for phase, seconds in project.timings.phases.items()
+                    },
+                }
+                for project, _ in self.projectResults
+            ]
+        }
 
         with open(outputFile, "w") as f:
-            f.write(xml_str)
+            json.dump(timings, f, indent=2)
 
     def saveHtmlToFile(self, outputFile: Path) -> None:
         with open(outputFile, "wt") as text_file:
@@ -0,0 +1,179 @@
+# SPDX-FileCopyrightText: 2026 Kdenlive contributors
+# SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
+
+import json
+import sqlite3
+import statistics
+from contextlib import closing
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Optional
+
+from CompareResult import CompareResult
+from RenderProject import RenderProject
+
+
+class ResultsHistory:
+    # Results of all runs in a SQLite database, used to find projects that
+    # render slower or compare worse than in the previous runs.
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        components TEXT
+    );
+    CREATE TABLE IF NOT EXISTS results (
+        run_id INTEGER NOT NULL REFERENCES runs(id),
+        project TEXT NOT NULL,
+        status TEXT NOT NULL,
+        render_duration REAL,
+        compare_duration REAL NOT NULL,
+        max_mse REAL NOT NULL,
+        video_errors TEXT NOT NULL,
+        audio_errors TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS results_project ON results(project, run_id);
+    """
+
+    # phases of the comparison, see compareRender
+    comparePhases = ["metadata", "framehash", "reference-audio", "video", "audio"]
+
+    # a render is slower if it takes this fraction longer than the baseline
+    # and at least minDurationIncrease seconds more
+    durationThreshold = 0.3
+    minDurationIncrease = 1.0
+    # MSE increases below this value are ignored
+    mseTolerance = 1.0
+
+    def __init__(self, databaseFile: Path):
+        self.databaseFile = databaseFile
+        self.databaseFile.parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(self.databaseFile)) as connection:
+            connection.executescript(self.schema)
+
+    def record(
+        self,
+        projectResults: list[tuple[RenderProject, CompareResult]],
+        components: Optional[dict[str, Any]],
+    ) -> None:
+        rows = []
+        for project, result in projectResults:
+            phases = project.timings.phases
+            # cached or skipped renders say nothing about the render speed
+            renderDuration = phases.get("render") if not project.renderCached else None
+            rows += [
+                (
+                    project.name,
+                    result.statusString,
+                    renderDuration,
+                    sum(phases.get(phase, 0.0) for phase in self.comparePhases),
+                    result.videoMaxMse,
+                    json.dumps(result.videoErrors),
+                    json.dumps(result.audioErrors),
+                )
+            ]
+
+        with closing(sqlite3.connect(self.databaseFile)) as connection:
+            with connection:
+                cursor = connection.execute(
+                    "INSERT INTO runs (timestamp, components) VALUES (?, ?)",
+                    (
+                        datetime.now(tz=timezone.utc).isoformat(),
+                        json.dumps(components) if components else None,
+                    ),
+                )
+                connection.executemany(
+                    "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(cursor.lastrowid,) + row for row in rows],
+                )
+
+    def regressions(self, baselineRuns: int = 5) -> list[str]:
+        # compare the latest run with the median of the baselineRuns
+        # previous runs of each project
+        with closing(sqlite3.connect(self.databaseFile)) as connection:
+            latestRun = connection.execute("SELECT MAX(id) FROM runs").fetchone()[0]
+            if latestRun is None:
+                return []
+
+            latestResults = connection.execute(
+                "SELECT project, status, render_duration, max_mse, video_errors,"
+                " audio_errors FROM results WHERE run_id = ? ORDER BY project",
+                (latestRun,),
+            ).fetchall()
+
+            regressions: list[str] = []
+            for (
+                project,
+                status,
+                duration,
+                maxMse,
+                videoErrors,
+                audioErrors,
+            ) in latestResults:
+                baseline = connection.execute(
+                    "SELECT render_duration, max_mse, video_errors, audio_errors,"
+                    " status FROM results WHERE project = ? AND run_id < ?"
+                    " ORDER BY run_id DESC LIMIT ?",
+                    (project, latestRun, baselineRuns),
+                ).fetchall()
+                if not baseline:
+                    continue
+
+                # a project that is missing or failed has no comparable values,
+                # so a changed status is reported instead of the other checks
+                baselineStatus = statistics.mode(row[4] for row in baseline)
+                if status != baselineStatus and status != "ok":
+                    regressions += [
+                        f"{project}: status {status}, baseline {baselineStatus}"
+                    ]
+                    continue
+
+                durations = [row[0] for row in baseline if row[0] is not None]
+                if duration is not None and durations:
+                    baselineDuration = statistics.median(durations)
+                    if duration > baselineDuration * (1 + self.durationThreshold) and (
+                        duration - baselineDuration >= self.minDurationIncrease
+                    ):
+                        increase = (duration / baselineDuration - 1) * 100
+                        regressions += [
+                            f"{project}: render took {duration:.2f}s, baseline"
+                            f" {baselineDuration:.2f}s (+{increase:.0f}%)"
+                        ]
+
+                baselineMse = statistics.median(row[1] for row in baseline)
+                if maxMse > baselineMse + self.mseTolerance:
+                    regressions += [
+                        f"{project}: max MSE {maxMse:.3f}, baseline {baselineMse:.3f}"
+                    ]
+
+                errorRanges = len(json.loads(videoErrors)) + len(
+                    json.loads(audioErrors)
+                )
+                baselineErrorRanges = statistics.median(
+                    len(json.loads(row[2])) + len(json.loads(row[3]))
+                    for row in baseline
+                )
+                if errorRanges > baselineErrorRanges:
+                    regressions += [
+                        f"{project}: {errorRanges} error ranges,"
+                        f" baseline {baselineErrorRanges:g}"
+                    ]
+
+        return regressions
+
+    def report(self, baselineRuns: int = 5) -> str:
+        with closing(sqlite3.connect(self.databaseFile)) as connection:
+            runCount, components = connection.execute(
+                "SELECT COUNT(*), (SELECT components FROM runs ORDER BY id DESC"
+                " LIMIT 1) FROM runs"
+            ).fetchone()
+
+        string = [f"==== REGRESSIONS (baseline: last {baselineRuns} runs) ===="]
+        string += [f"{runCount} run(s) recorded in {self.databaseFile}"]
+        if components:
+            string += [f"Latest components: {components}"]
+
+        regressions = self.regressions(baselineRuns)
+        string += regressions if regressions else ["No regressions found"]
+        return "\n".join(string)
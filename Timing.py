@@ -0,0 +1,38 @@
+# SPDX-FileCopyrightText: 2026 Kdenlive contributors
+# SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class PhaseTimings:
+    def __init__(self) -> None:
+        self._phases: dict[str, float] = {}
+        # phases of one project may be measured from different worker threads
+        self._lock = threading.Lock()
+
+    def __str__(self) -> str:
+        return ", ".join(f"{p}: {s:.2f}s" for p, s in self.phases.items())
+
+    def add(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self._phases[phase] = self._phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    @property
+    def phases(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._phases)
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
@@ -0,0 +1,100 @@
+# SPDX-FileCopyrightText: 2026 Kdenlive contributors
+# SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
+
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from Config import MetricConfig, MetricType
+
+
+class VideoComparator(ABC):
+    # A per frame video metric computed from the stats of an ffmpeg filter
+    # (see PnsrStatsParser). Keeps the worst value of all compared frames.
+    filterName = ""
+    name = ""
+    defaultThreshold = 0.0
+    # whether higher values mean larger differences
+    higherIsWorse = True
+
+    def __init__(self, threshold: Optional[float] = None):
+        self.threshold = self.defaultThreshold if threshold is None else threshold
+        self.worst: Optional[float] = None
+
+    @abstractmethod
+    def value(self, stats: dict[str, float]) -> float:
+        pass
+
+    def isBroken(self, stats: dict[str, float]) -> bool:
+        value = self.value(stats)
+        if self.worst is None or self._isWorse(value, self.worst):
+            self.worst = value
+        return self._isWorse(value, self.threshold)
+
+    @property
+    def failed(self) -> bool:
+        return self.worst is not None and self._isWorse(self.worst, self.threshold)
+
+    def _isWorse(self, value: float, other: float) -> bool:
+        return value > other if self.higherIsWorse else value < other
+
+    def summary(self) -> str:
+        return f"{self.name}: {self.worst:.3f}"
+
+
+class PsnrComparator(VideoComparator):
+    # average MSE of all planes
+    filterName = "psnr"
+    name = "psnr"
+    defaultThreshold = 10.0
+
+    def value(self, stats: dict[str, float]) -> float:
+        return stats["mse_avg"]
+
+    def summary(self) -> str:
+        return f"PNSR: {self.worst:.3f}"
+
+
+class PlaneMseComparator(VideoComparator):
+    # highest MSE of the single planes (Y/U/V or R/G/B), a difference in one
+    # chroma plane is not averaged away
+    filterName = "psnr"
+    name = "plane-mse"
+    defaultThreshold = 10.0
+
+    def value(self, stats: dict[str, float]) -> float:
+        return max(
+            v for k, v in stats.items() if k.startswith("mse_") and k != "mse_avg"
+        )
+
+    def summary(self) -> str:
+        return f"plane MSE: {self.worst:.3f}"
+
+
+class SsimComparator(VideoComparator):
+    filterName = "ssim"
+    name = "ssim"
+    defaultThreshold = 0.98
+    higherIsWorse = False
+
+    def value(self, stats: dict[str, float]) -> float:
+        return stats["All"]
+
+    def summary(self) -> str:
+        return f"SSIM: {self.worst:.4f}"
+
+
+comparatorTypes: dict[MetricType, type[VideoComparator]] = {
+    MetricType.PSNR: PsnrComparator,
+    MetricType.PLANE_MSE: PlaneMseComparator,
+    MetricType.SSIM: SsimComparator,
+}
+
+
+def createComparators(metrics: Optional[list[MetricConfig]]) -> list[VideoComparator]:
+    # the comparators selected for a project, by default only the average MSE
+    if not metrics:
+        return [PsnrComparator()]
+
+    return [
+        comparatorTypes[metric["type"]](metric.get("threshold")) for metric in metrics
+    ]
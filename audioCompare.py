@@ -1,145 +1,523 @@
 # SPDX-FileCopyrightText: 2024 Julius Künzel <julius.kuenzel@kde.org>
 # SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
 
+import io
 import os
+import struct
 import subprocess
-import tempfile
-import wave
+from fractions import Fraction
+from functools import partial
 from pathlib import Path
-from typing import Any, Type
+from typing import IO, Any, Callable, Optional, Type, Union
 
 import numpy as np
 import numpy.typing as npt
 
 from CompareResult import CompareResult, CompareResultStatus
+from pnsr import PipeReader
 
 ffmpegCommand = os.environ.get("TEST_FFMPEG_CMD", "ffmpeg").split()
 
 
-def get_audio_data(fileName: str) -> tuple[npt.NDArray[Any], int, int, int]:
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        wavFileName = convert_to_wav(fileName, tmpdirname)
-
-        with wave.open(str(wavFileName), "rb") as wav_file:
-            frames = wav_file.readframes(wav_file.getnframes())
-            byted = wav_file.getsampwidth()
-
-            dtype: Type[np.integer[Any]] = np.int8
-
-            dtype = np.int8
-            if byted == 1:
-                dtype = np.int8
-            elif byted == 2:
-                dtype = np.int16
-            elif byted == 4:
-                dtype = np.int32
-            elif byted == 8:
-                dtype = np.int64
-
-            return (
-                np.frombuffer(frames, dtype=dtype),
-                wav_file.getframerate(),
-                byted,
-                wav_file.getnchannels(),
+# number of windows (video frames) compared at once, bounds the memory of the comparison
+chunk_windows = 256
+# offsets of the render audio up to this duration are detected
+max_offset_seconds = 1.0
+# minimum normalized cross correlation of a detected offset
+min_offset_correlation = 0.5
+# correlations within this fraction of the highest one count as equal
+offset_tolerance = 1e-6
+# number of blocks (about 24 seconds each) used to detect an offset, starting
+# at the first chunk with errors, bounds the cost for long tracks
+max_offset_chunks = 8
+
+
+def read_wav_header(stream: IO[bytes]) -> tuple[int, int, int, Optional[int]]:
+    # Returns sample rate, sample width, channel count and the size of the
+    # sample data (None if unknown, e.g. when written to a pipe) and leaves
+    # the stream at the start of the sample data.
+    riff = stream.read(12)
+    if len(riff) < 12 or riff[0:4] != b"RIFF" or riff[8:12] != b"WAVE":
+        raise Exception("Invalid wav data")
+
+    fmt: Optional[tuple[int, int, int]] = None
+    while True:
+        chunkHeader = stream.read(8)
+        if len(chunkHeader) < 8:
+            raise Exception("No audio samples found in wav data")
+
+        chunkId, chunkSize = struct.unpack("<4sI", chunkHeader)
+        if chunkId == b"data":
+            break
+
+        # chunks are padded to an even size
+        chunk = stream.read(chunkSize + chunkSize % 2)
+        if chunkId == b"fmt ":
+            _, channels, rate, _, _, bits = struct.unpack("<HHIIHH", chunk[:16])
+            fmt = (rate, bits // 8, channels)
+
+    if not fmt:
+        raise Exception("No format information found in wav data")
+
+    dataSize: Optional[int] = None if chunkSize == 0xFFFFFFFF else chunkSize
+    return fmt + (dataSize,)
+
+
+def sample_dtype(byted: int) -> Type[np.integer[Any]]:
+    dtype: Type[np.integer[Any]] = np.int8
+    if byted == 1:
+        dtype = np.int8
+    elif byted == 2:
+        dtype = np.int16
+    elif byted == 4:
+        dtype = np.int32
+    elif byted == 8:
+        dtype = np.int64
+
+    return dtype
+
+
+class AudioReader:
+    # Interleaved samples of a decoded audio track, read in chunks so the
+    # memory does not depend on the duration of the track.
+
+    def __init__(self, stream: IO[bytes], rate: int, width: int, channels: int):
+        self.stream = stream
+        self.rate = rate
+        self.width = width
+        self.channels = channels
+        self.dtype = sample_dtype(width)
+        # sample frames of silence read before the samples
+        self.padding = 0
+
+    def __enter__(self) -> "AudioReader":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.stream.close()
+
+    def skip(self, frames: int) -> None:
+        # skips the first sample frames, a negative count inserts silence
+        # before them instead
+        if frames < 0:
+            self.padding = -frames
+        while frames > 0:
+            chunk = min(frames, self.rate)
+            if len(self.read(chunk)) < chunk * self.channels:
+                break
+            frames -= chunk
+
+    def read(self, frames: int) -> npt.NDArray[Any]:
+        # up to frames sample frames, fewer only at the end of the track
+        padding = min(self.padding, frames)
+        self.padding -= padding
+        frameSize = self.channels * self.width
+        data = self.read_bytes((frames - padding) * frameSize)
+        samples = np.frombuffer(
+            data, dtype=self.dtype, count=len(data) // frameSize * self.channels
+        )
+        if padding > 0:
+            silence = np.zeros(padding * self.channels, dtype=self.dtype)
+            samples = np.concatenate((silence, samples))
+        return samples
+
+    def read_bytes(self, size: int) -> bytes:
+        return self.stream.read(size)
+
+
+class FfmpegAudioReader(AudioReader):
+    # The resampled first audio stream of a file, written as wav by ffmpeg to
+    # its stdout pipe and read without temporary files. stderr is drained in
+    # a thread, a failure of ffmpeg is raised at the end of the samples.
+
+    def __init__(self, fileName: str, target_rate: int = 44100):
+        self.cmd: list[str] = ffmpegCommand + [
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-i",
+            str(fileName),
+            "-map",
+            "0:a:0",
+            "-ar",
+            str(target_rate),
+            "-f",
+            "wav",
+            "-",
+        ]
+        self.process = subprocess.Popen(
+            self.cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        assert self.process.stdout and self.process.stderr
+        self.stderrReader = PipeReader(
+            io.TextIOWrapper(self.process.stderr, errors="replace")
+        )
+        try:
+            rate, width, channels, _ = read_wav_header(self.process.stdout)
+        except Exception:
+            self.close()
+            # without samples the error of ffmpeg is more helpful
+            self.check_exit()
+            raise
+        super().__init__(self.process.stdout, rate, width, channels)
+
+    def close(self) -> None:
+        # the rest of the track is not needed if the other track ended first
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.stderrReader.join()
+        assert self.process.stdout
+        self.process.stdout.close()
+
+    def read_bytes(self, size: int) -> bytes:
+        data = super().read_bytes(size)
+        if len(data) < size:
+            self.check_exit()
+        return data
+
+    def check_exit(self) -> None:
+        if self.process.wait() != 0:
+            self.stderrReader.join()
+            stderr = self.stderrReader.content
+            print(
+                f"Decoding audio with ffmpeg failed. Command:\n{self.cmd}\nOutput to stderr:\n{stderr}"
             )
-
-
-def convert_to_wav(sourceFile: str, taregetDir: str, target_rate: int = 44100) -> Path:
-    stem = Path(sourceFile).stem
-    targetFile = Path(taregetDir) / f"{stem}_{target_rate}Hz_converted.wav"
-    cmd: list[str] = ffmpegCommand + [
-        "-hide_banner",
-        "-loglevel",
-        "error",
-        "-y",  # overwrite output files
-        "-i",
-        str(sourceFile),
-        "-ar",
-        str(target_rate),
-        str(targetFile),
-        "-y",
-    ]
-    result = subprocess.run(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
-    )
-
-    if result.returncode != 0:
-        print(
-            f"Converting to wav file with ffmpeg failed. Command:\n{cmd}\nOutput to stderr:\n{result.stderr}"
+            raise Exception(f"Decoding audio with ffmpeg failed: {stderr}")
+
+
+def open_raw_audio(
+    fileName: Union[str, Path], rate: int, width: int, channels: int
+) -> AudioReader:
+    # interleaved samples without header, e.g. from the ReferenceCache
+    return AudioReader(open(fileName, "rb"), rate, width, channels)
+
+
+# opens a new reader at the start of a track, a track is read again for the
+# comparison after the alignment
+AudioSource = Callable[[], AudioReader]
+
+
+def window_rms_diff(
+    data1: npt.NDArray[Any],
+    data2: npt.NDArray[Any],
+    bounds: npt.NDArray[np.int64],
+    channels: int,
+) -> npt.NDArray[np.float64]:
+    # RMS of the difference per window and channel of interleaved data, the
+    # windows start at the sample frames in bounds (the last one ends the last
+    # window). Computed in one batch, the difference is taken in a wide dtype
+    # to avoid integer wrap-around.
+    length = int(bounds[-1]) * channels
+    window1 = data1[:length].reshape(-1, channels)
+    window2 = data2[:length].reshape(-1, channels)
+    diff = np.subtract(window1, window2, dtype=np.float64)
+    square = np.square(diff, out=diff)
+    sums = np.add.reduceat(square, bounds[:-1], axis=0)
+    rms: npt.NDArray[np.float64] = np.sqrt(sums / np.diff(bounds)[:, np.newaxis])
+    return rms
+
+
+def find_runs(mask: npt.NDArray[Any]) -> list[tuple[int, int]]:
+    # (first, last) indices of the consecutive runs of True values
+    padded = np.zeros(len(mask) + 2, dtype=np.bool_)
+    padded[1:-1] = mask
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return [(int(start), int(end) - 1) for start, end in zip(edges[0::2], edges[1::2])]
+
+
+class WindowRmsComparator:
+    # RMS of the difference of reference and render per channel in windows of
+    # one video frame, fed with chunks of whole windows. A window is broken if
+    # any channel is above the threshold. The runs of broken windows are
+    # collected while feeding, the memory does not depend on the duration.
+
+    def __init__(self, rate: int, fps: Fraction, channels: int, threshold: float = 0.2):
+        self.rate = rate
+        self.fps = fps
+        self.channels = channels
+        self.threshold = threshold
+        self.windows = 0
+        self.errorWindows = 0
+        # (first, last) windows of each run
+        self.runs: list[tuple[int, int]] = []
+
+    def window_start(self, window: int) -> int:
+        # first sample frame of a window, exact for fractional frame rates
+        return window * self.rate * self.fps.denominator // self.fps.numerator
+
+    def window_count(self, frames: int) -> int:
+        # number of complete windows in the first sample frames, the largest
+        # count whose end (window_start) is not after frames
+        return ((frames + 1) * self.fps.numerator - 1) // (
+            self.rate * self.fps.denominator
         )
-        raise Exception("Converting to wav file with ffmpeg failed.")
 
-    return targetFile
+    def feed(self, reference: npt.NDArray[Any], render: npt.NDArray[Any]) -> None:
+        # interleaved samples starting at the next window
+        first = self.windows
+        start = self.window_start(first)
+        frames = min(len(reference), len(render)) // self.channels
+        num_windows = self.window_count(start + frames) - first
+        if num_windows <= 0:
+            return
+
+        windows = np.arange(first, first + num_windows + 1, dtype=np.int64)
+        bounds = (
+            windows * (self.rate * self.fps.denominator) // self.fps.numerator - start
+        )
+        rms_diff = window_rms_diff(reference, render, bounds, self.channels)
+        errorWindows = np.any(rms_diff > self.threshold, axis=1)
+        for runStart, runEnd in find_runs(errorWindows):
+            runStart, runEnd = runStart + first, runEnd + first
+            if self.runs and self.runs[-1][1] == runStart - 1:
+                # continues the run at the end of the previous chunk
+                runStart = self.runs.pop()[0]
+            self.runs += [(runStart, runEnd)]
+
+        self.windows += num_windows
+        self.errorWindows += int(np.count_nonzero(errorWindows))
+
+    @property
+    def errorRanges(self) -> list[tuple[int, int]]:
+        # Video frame numbers of the runs, counted from 1 like the video
+        # errors: the first broken frame and the frame after the last one (the
+        # last one at the end of the track).
+        return [(start + 1, min(end + 2, self.windows)) for start, end in self.runs]
+
+
+def sample_range(data: npt.NDArray[Any], start: int, end: int) -> npt.NDArray[Any]:
+    # samples start to end (exclusive), zero outside of the data
+    if start >= 0 and end <= len(data):
+        return data[start:end]
+
+    samples = np.zeros(end - start, dtype=data.dtype)
+    first, last = max(start, 0), min(end, len(data))
+    if first < last:
+        samples[first - start : last - start] = data[first:last]
+    return samples
+
+
+def mono_frames(
+    data: npt.NDArray[Any], channels: int, start: int, end: int
+) -> npt.NDArray[np.float64]:
+    # mono mix of the sample frames start to end (exclusive) of interleaved
+    # data, zero outside of the data
+    samples = sample_range(data, start * channels, end * channels)
+    mono = np.zeros(end - start)
+    for channel in range(channels):
+        mono += samples[channel::channels]
+    return mono
+
+
+class OffsetDetector:
+    # Lag in sample frames of the render against the reference (positive if
+    # the render is late) with the highest cross correlation within
+    # +-max_lag, and its normalized correlation. Fed with the chunks of the
+    # comparison, the correlation is summed up from blocks correlated with
+    # FFTs as soon as they are complete, up to max_offset_chunks blocks:
+    # O(n log n) with memory independent of the duration.
+
+    def __init__(self, channels: int, max_lag: int, render_tail: npt.NDArray[Any]):
+        self.channels = channels
+        self.max_lag = max_lag
+        self.fft_size = 1 << max(20, (4 * max_lag).bit_length())
+        self.block_frames = self.fft_size - 2 * max_lag
+        self.blocks = 0
+        self.correlation = np.zeros(2 * max_lag + 1)
+        self.energy1 = self.energy2 = 0.0
+        # mono mix of the data not correlated yet, the render starts with the
+        # mono mix of the max_lag sample frames before the first chunk
+        self.reference = np.zeros(0)
+        self.render = render_tail
+
+    @property
+    def done(self) -> bool:
+        return self.blocks >= max_offset_chunks
+
+    def feed(self, reference: npt.NDArray[Any], render: npt.NDArray[Any]) -> None:
+        # interleaved samples following the previously fed ones
+        if self.done:
+            return
+
+        self.reference = np.concatenate(
+            (
+                self.reference,
+                mono_frames(
+                    reference, self.channels, 0, len(reference) // self.channels
+                ),
+            )
+        )
+        self.render = np.concatenate(
+            (
+                self.render,
+                mono_frames(render, self.channels, 0, len(render) // self.channels),
+            )
+        )
+        # a block of the render needs max_lag frames after the reference block
+        while (
+            not self.done
+            and len(self.reference) >= self.block_frames
+            and len(self.render) >= self.block_frames + 2 * self.max_lag
+        ):
+            self.correlate(self.block_frames)
+
+    def correlate(self, frames: int) -> None:
+        chunk1 = self.reference[:frames]
+        chunk2 = sample_range(self.render, 0, frames + 2 * self.max_lag)
+        # circular correlation, without wrap-around for the lags of interest
+        # as fft_size covers chunk2 completely
+        spectrum = np.fft.rfft(chunk2, self.fft_size) * np.conj(
+            np.fft.rfft(chunk1, self.fft_size)
+        )
+        self.correlation += np.fft.irfft(spectrum, self.fft_size)[
+            : 2 * self.max_lag + 1
+        ]
+        self.energy1 += float(np.dot(chunk1, chunk1))
+        overlap = chunk2[self.max_lag : self.max_lag + frames]
+        self.energy2 += float(np.dot(overlap, overlap))
+
+        self.reference = self.reference[frames:]
+        self.render = self.render[frames:]
+        self.blocks += 1
+
+    def result(self) -> tuple[int, float]:
+        # the incomplete block at the end of the tracks is correlated too
+        frames = min(len(self.reference), len(self.render) - self.max_lag)
+        if not self.done and frames > 0:
+            self.correlate(frames)
+
+        if self.energy1 == 0.0 or self.energy2 == 0.0:
+            return 0, 0.0
+
+        # periodic audio correlates about equally at several lags, the
+        # smallest of them is taken
+        peaks = np.flatnonzero(
+            self.correlation >= self.correlation.max() * (1 - offset_tolerance)
+        )
+        peak = int(peaks[np.argmin(np.abs(peaks - self.max_lag))])
+        return peak - self.max_lag, float(
+            self.correlation[peak] / np.sqrt(self.energy1 * self.energy2)
+        )
 
 
-def audioCompare(referenceFile: str, lastRender: str, fps: int = 25) -> CompareResult:
+def compare_chunks(
+    reference: AudioReader,
+    render: AudioReader,
+    fps: Fraction,
+    detect_offset: bool = False,
+) -> tuple[WindowRmsComparator, Optional[OffsetDetector]]:
+    # Both tracks are read in lockstep in chunks of chunk_windows windows until
+    # one of them ends. With detect_offset the offset is searched from the
+    # first chunk with errors on, a shifted render differs in nearly every
+    # window.
+    comparator = WindowRmsComparator(reference.rate, fps, reference.channels)
+    channels = reference.channels
+    max_lag = int(reference.rate * max_offset_seconds)
+    detector: Optional[OffsetDetector] = None
+    previous = np.zeros(0, dtype=render.dtype)
+    first = 0
+    while True:
+        frames = comparator.window_start(
+            first + chunk_windows
+        ) - comparator.window_start(first)
+        chunk1 = reference.read(frames)
+        chunk2 = render.read(frames)
+        errorWindows = comparator.errorWindows
+        comparator.feed(chunk1, chunk2)
+
+        if detect_offset:
+            if detector is None and comparator.errorWindows > errorWindows:
+                end = len(previous) // channels
+                tail = mono_frames(previous, channels, end - max_lag, end)
+                detector = OffsetDetector(channels, max_lag, tail)
+            if detector:
+                detector.feed(chunk1, chunk2)
+            previous = chunk2
+
+        if min(len(chunk1), len(chunk2)) < frames * channels:
+            return comparator, detector
+        first += chunk_windows
+
+
+def audioCompare(
+    referenceFile: str,
+    lastRender: str,
+    fps: Fraction = Fraction(25),
+    align: bool = False,
+    target_rate: int = 44100,
+    referenceAudio: Optional[AudioSource] = None,
+) -> CompareResult:
+    # The resampled audio is read from the ffmpeg pipes in chunks without
+    # temporary files. With referenceAudio given (e.g. from the
+    # ReferenceCache) only the render audio is decoded.
     try:
-        data1, rate1, sampWidth1, ch1 = get_audio_data(referenceFile)
-        data2, rate2, sampWidth2, ch2 = get_audio_data(lastRender)
+        return compareAudioData(
+            referenceAudio or partial(FfmpegAudioReader, referenceFile, target_rate),
+            partial(FfmpegAudioReader, lastRender, target_rate),
+            fps,
+            align,
+        )
     except Exception as err:
-        res = CompareResult(CompareResultStatus.PROCESS_FAILURE)
+        res = CompareResult(
+            CompareResultStatus.PROCESS_FAILURE, "audio comparison failed"
+        )
         res.errorDetails = str(err)
         return res
 
-    if rate1 != rate2:
-        return CompareResult(
-            CompareResultStatus.CONTENT_COMPARE_FAILURE,
-            f"sample rate differes {rate1} vs. {rate2}",
-        )
-
-    samples_per_frame = int(rate1 / 25)
-
-    num_windows = int(min(len(data1), len(data2)) // samples_per_frame)
-
-    def samples_to_frames(sample: int) -> int:
-        return int((sample / sampWidth1) / samples_per_frame)
-
-    firstFrame = -1
-    errorArray: list[tuple[int, int]] = []
-    firstErrorFrame = -1
-    framesDuration = 0
 
-    for i in range(num_windows):
-        start = i * samples_per_frame
-        end = start + samples_per_frame
-
-        # Extrahiere die Audiodaten des aktuellen Fensters
-        window1 = data1[start:end]
-        window2 = data2[start:end]
-
-        mean = abs(np.mean((window1 - window2) ** 2))
-        rms_diff = np.sqrt(mean)
-
-        if rms_diff > 0.2:
-            frame = samples_to_frames(start)
-
-            if firstFrame < 0:
-                firstFrame = frame
-
-            if firstErrorFrame < 0:
-                firstErrorFrame = frame
-        else:
-            if firstFrame >= 0:
-                errorArray += [(firstFrame, frame)]
-                firstFrame = -1
+def compareAudioData(
+    referenceAudio: AudioSource,
+    renderAudio: AudioSource,
+    fps: Fraction = Fraction(25),
+    align: bool = False,
+) -> CompareResult:
+    # Each video frame of the project is compared as one window, in chunks of
+    # chunk_windows. With align the render audio is compared again after
+    # shifting it by a detected offset. The offset is reported either way.
+    with referenceAudio() as reference, renderAudio() as render:
+        if reference.rate != render.rate:
+            return CompareResult(
+                CompareResultStatus.CONTENT_COMPARE_FAILURE,
+                f"sample rate differes {reference.rate} vs. {render.rate}",
+            )
 
-            framesDuration += 1
+        if reference.channels != render.channels:
+            # the channels can not be compared one by one
+            return CompareResult(
+                CompareResultStatus.CONTENT_COMPARE_FAILURE,
+                f"channel count differes: {reference.channels} vs. {render.channels}",
+            )
 
-    if firstFrame >= 0:
-        errorArray += [(firstFrame, frame)]
+        comparator, detector = compare_chunks(reference, render, fps, True)
 
+    rate = reference.rate
     errorMsg: list[str] = []
-    if ch1 != ch2:
-        errorMsg += [f"channel count differes: {ch1} vs. {ch2}"]
-
+    if detector:
+        lag, correlation = detector.result()
+        if lag != 0 and correlation >= min_offset_correlation:
+            errorMsg += [f"audio offset {lag} samples ({lag * 1000 / rate:.1f} ms)"]
+            if align:
+                # the render is read lag sample frames later, missing audio
+                # at the start is silence
+                with referenceAudio() as reference, renderAudio() as render:
+                    render.skip(lag)
+                    comparator, _ = compare_chunks(reference, render, fps)
+                errorMsg[-1] += ", compared after alignment"
+
+    errorArray = comparator.errorRanges
     if len(errorArray) > 0 or len(errorMsg) > 0:
-        errorMsg += [f"frame {firstErrorFrame}"]
+        if errorArray:
+            errorMsg += [f"frame {errorArray[0][0]}"]
         res = CompareResult(
             CompareResultStatus.CONTENT_COMPARE_FAILURE,
             ", ".join(errorMsg),
         )
         res.audioErrors = errorArray
-        res.framesDuration = framesDuration
+        res.framesDuration = comparator.windows
 
         return res
 
@@ -0,0 +1,58 @@
+# SPDX-FileCopyrightText: 2026 Kdenlive contributors
+# SPDX-License-Identifier: GPL-3.0-only OR LicenseRef-KDE-Accepted-GPL
+
+from fractions import Fraction
+from typing import Optional
+
+from audioCompare import AudioSource, audioCompare
+from CompareResult import CompareResult, CompareResultStatus
+from pnsr import FailFast, pnsrCompare
+from Timing import PhaseTimings
+from VideoComparators import VideoComparator
+
+
+def avCompare(
+    referenceFile: str,
+    lastRender: str,
+    fps: Fraction = Fraction(25),
+    compareVideo: bool = True,
+    compareAudio: bool = True,
+    target_rate: int = 44100,
+    timings: Optional[PhaseTimings] = None,
+    failFast: FailFast = FailFast(),
+    referenceAudio: Optional[AudioSource] = None,
+    comparators: Optional[list[VideoComparator]] = None,
+    videoFrames: Optional[list[int]] = None,
+    videoFrameCount: int = 0,
+    alignAudio: bool = False,
+) -> CompareResult:
+    # The video streams of both files are decoded in one ffmpeg run by
+    # pnsrCompare, the audio of each file in a separate run by audioCompare
+    # (read again if the render is aligned). A failure of one run does not
+    # fail the comparison of the other stream.
+    timings = timings or PhaseTimings()
+    compareResult = CompareResult(CompareResultStatus.SUCCESS)
+
+    if compareVideo:
+        with timings.measure("video"):
+            compareResult += pnsrCompare(
+                referenceFile,
+                lastRender,
+                failFast,
+                comparators,
+                videoFrames,
+                videoFrameCount,
+            )
+
+    if compareAudio:
+        with timings.measure("audio"):
+            compareResult += audioCompare(
+                referenceFile,
+                lastRender,
+                fps,
+                alignAudio,
+                target_rate,
+                referenceAudio,
+            )
+
+    return compareResult
@@ -4,83 +4,280 @@
 
 import os
 import subprocess
+import threading
+from typing import IO, Optional
 
 from CompareResult import CompareResult, CompareResultStatus
+from VideoComparators import PsnrComparator, VideoComparator
 
 ffmpegCommand = os.environ.get("TEST_FFMPEG_CMD", "ffmpeg").split()
 
 
-def pnsrCompare(referenceFile: str, lastRender: str) -> CompareResult:
-    cmd = ffmpegCommand + [
-        "-hide_banner",
-        "-loglevel",
-        "error",
-        "-i",
-        referenceFile,
-        "-i",
-        lastRender,
-        "-filter_complex",
-        "psnr=f=-",
-        "-f",
-        "null",
-        "/dev/null",
-    ]
-    result = subprocess.run(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
-    )
+class FailFast:
+    def __init__(self, maxBadFrames: int = 0, maxErrorRanges: int = 0):
+        # 0 disables the respective limit
+        self.maxBadFrames = maxBadFrames
+        self.maxErrorRanges = maxErrorRanges
 
-    # Check if process failed
-    if result.returncode != 0:
-        res = CompareResult(CompareResultStatus.PROCESS_FAILURE)
-        res.errorDetails = result.stderr
-        return res
+    @property
+    def enabled(self) -> bool:
+        return self.maxBadFrames > 0 or self.maxErrorRanges > 0
 
-    firstFrame = -1
-    firstErrorFrame = -1
-    errorArray: list[tuple[int, int]] = []
-    maxPnsrValue = 0.0
-    threshold = 10
-    frame = 0
-    framesDuration = 0
 
-    for line in result.stdout.split("\n"):
-        # Example line:
+class PnsrStatsParser:
+    def __init__(
+        self,
+        failFast: FailFast = FailFast(),
+        comparators: Optional[list[VideoComparator]] = None,
+        frameNumbers: Optional[list[int]] = None,
+        frameCount: int = 0,
+    ):
+        self.failFast = failFast
+        # if only some frames are compared, their numbers and the number of
+        # all frames
+        self.frameNumbers = frameNumbers
+        self.frameCount = frameCount
+        self.comparators = comparators or [PsnrComparator()]
+        # the psnr filter always runs, its MSE rates the error ranges
+        self.filters = {"psnr"} | {c.filterName for c in self.comparators}
+        self.firstFrame = -1
+        self.firstErrorFrame = -1
+        self.errorArray: list[tuple[int, int]] = []
+        self.errorMse: list[float] = []
+        self.rangeMse = 0.0
+        self.maxMse = 0.0
+        self.frame = 0
+        self.framesDuration = 0
+        self.badFrames = 0
+        self.aborted = False
+        # stats of frames not reported by all filters yet
+        self._pendingStats: dict[int, dict[str, float]] = {}
+        self._pendingFilters: dict[int, set[str]] = {}
+
+    def feed(self, line: str) -> None:
+        # Example lines of the psnr and ssim filters:
         # n:1 mse_avg:0.00 mse_y:0.00 mse_u:0.00 mse_v:0.00 psnr_avg:inf psnr_y:inf psnr_u:inf psnr_v:inf
+        # n:1 Y:0.998273 U:0.998184 V:0.999354 All:0.998438 (28.064183)
+
+        stats: dict[str, float] = {}
+        for value in line.split():
+            key, separator, number = value.partition(":")
+            if separator:
+                stats[key] = float(number)
+        if "n" not in stats or len(stats) < 2:
+            return
+
+        frame = int(stats.pop("n"))
+        if self.frameNumbers:
+            frame = self.frameNumbers[frame - 1]
+        if self.filters == {"psnr"}:
+            self._feedFrame(frame, stats)
+            return
 
-        values = line.split()
-        if len(values) < 2:
-            continue
+        # all filters write to stdout, the lines of one frame are combined
+        filterName = "psnr" if "mse_avg" in stats else "ssim"
+        frameStats = self._pendingStats.setdefault(frame, {})
+        frameStats.update(stats)
+        frameFilters = self._pendingFilters.setdefault(frame, set())
+        frameFilters.add(filterName)
+        if frameFilters == self.filters:
+            del self._pendingStats[frame]
+            del self._pendingFilters[frame]
+            self._feedFrame(frame, frameStats)
 
-        frame = int(values[0].split(":")[1])
-        mse_avg = float(values[1].split(":")[1])
+    def _feedFrame(self, frame: int, stats: dict[str, float]) -> None:
+        self.frame = frame
+        mse_avg = stats["mse_avg"]
+        self.maxMse = max(mse_avg, self.maxMse)
 
-        if mse_avg > threshold:
-            maxPnsrValue = max(mse_avg, maxPnsrValue)
-            if firstFrame < 0:
-                firstFrame = frame
+        # every comparator sees every frame to track its worst value
+        broken = [c.isBroken(stats) for c in self.comparators]
 
-            if firstErrorFrame < 0:
-                firstErrorFrame = frame
+        if any(broken):
+            self.badFrames += 1
+            if self.firstFrame < 0:
+                self.firstFrame = self.frame
+                self.rangeMse = 0.0
+            self.rangeMse = max(mse_avg, self.rangeMse)
+
+            if self.firstErrorFrame < 0:
+                self.firstErrorFrame = self.frame
         else:
-            if firstFrame >= 0:
-                errorArray += [(firstFrame, frame)]
-                firstFrame = -1
+            if self.firstFrame >= 0:
+                self.errorArray += [(self.firstFrame, self.frame)]
+                self.errorMse += [self.rangeMse]
+                self.firstFrame = -1
 
-        framesDuration += 1
+        self.framesDuration += 1
 
-    if firstFrame >= 0:
-        errorArray += [(firstFrame, frame)]
+    @property
+    def errorRangeCount(self) -> int:
+        return len(self.errorArray) + (1 if self.firstFrame >= 0 else 0)
 
-    if len(errorArray) > 0:
-        res = CompareResult(
-            CompareResultStatus.CONTENT_COMPARE_FAILURE,
-            f"frame {firstErrorFrame}, PNSR: {maxPnsrValue:.3f}",
+    @property
+    def shouldAbort(self) -> bool:
+        maxBadFrames = self.failFast.maxBadFrames
+        maxErrorRanges = self.failFast.maxErrorRanges
+        return (maxBadFrames > 0 and self.badFrames >= maxBadFrames) or (
+            maxErrorRanges > 0 and self.errorRangeCount >= maxErrorRanges
         )
-        res.videoErrors = errorArray
-        res.framesDuration = framesDuration
 
-        return res
+    def parseStream(self, stream: IO[str], process: subprocess.Popen[str]) -> None:
+        # parse the stats while ffmpeg is still running and stop it as soon
+        # as the fail-fast limits are reached
+        for line in stream:
+            self.feed(line)
+            if self.failFast.enabled and self.shouldAbort:
+                self.aborted = True
+                process.kill()
+                break
+
+    def result(self) -> CompareResult:
+        errorArray = list(self.errorArray)
+        errorMse = list(self.errorMse)
+        if self.firstFrame >= 0:
+            errorArray += [(self.firstFrame, self.frame)]
+            errorMse += [self.rangeMse]
+
+        metrics = {c.name: c.worst for c in self.comparators if c.worst is not None}
+
+        framesDuration = self.framesDuration
+        if self.frameNumbers:
+            # as if all frames up to the last compared one were compared
+            framesDuration = self.frame if self.aborted else self.frameCount
+
+        if len(errorArray) > 0:
+            msg = f"frame {self.firstErrorFrame}, " + ", ".join(
+                c.summary() for c in self.comparators if c.failed
+            )
+            if self.aborted:
+                msg += f" (aborted after {framesDuration} frames)"
+            res = CompareResult(CompareResultStatus.CONTENT_COMPARE_FAILURE, msg)
+            res.videoErrors = errorArray
+            res.videoErrorMse = errorMse
+            res.videoMaxMse = self.maxMse
+            res.videoMetrics = metrics
+            res.framesDuration = framesDuration
+
+            return res
+
+        else:
+            # job succeded
+            res = CompareResult(CompareResultStatus.SUCCESS)
+            res.videoMaxMse = self.maxMse
+            res.videoMetrics = metrics
+            return res
+
+
+class PipeReader(threading.Thread):
+    # drains a pipe so ffmpeg does not block on it while another pipe is parsed
+    def __init__(self, stream: IO[str]):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.content = ""
+        self.start()
+
+    def run(self) -> None:
+        self.content = self.stream.read()
+
 
+# maximum number of frame ranges compared separately
+maxSelectRanges = 200
+
+
+def frameRanges(frames: list[int]) -> list[tuple[int, int]]:
+    # consecutive frame numbers as (first, last) ranges
+    ranges: list[tuple[int, int]] = []
+    for frame in frames:
+        if ranges and ranges[-1][1] == frame - 1:
+            ranges[-1] = (ranges[-1][0], frame)
+        else:
+            ranges += [(frame, frame)]
+    return ranges
+
+
+def pnsrCompare(
+    referenceFile: str,
+    lastRender: str,
+    failFast: FailFast = FailFast(),
+    comparators: Optional[list[VideoComparator]] = None,
+    videoFrames: Optional[list[int]] = None,
+    videoFrameCount: int = 0,
+) -> CompareResult:
+    # The filters of all video comparators run on the same decoded frames and
+    # write their stats to stdout, which is parsed while ffmpeg is running.
+    # With videoFrames (e.g. from FrameHashComparison.suspectFrames) only
+    # these frames are compared.
+    ranges = frameRanges(videoFrames or [])
+    if len(ranges) > maxSelectRanges:
+        # the select expression would get too long
+        videoFrames = None
+
+    parser = PnsrStatsParser(failFast, comparators, videoFrames, videoFrameCount)
+
+    filters: list[str] = []
+    outputs: list[str] = []
+    refVideo, renVideo = "[0:v:0]", "[1:v:0]"
+    frameLimit: list[str] = []
+    if videoFrames:
+        # select counts the frames from 0, psnr from 1
+        selection = "select=" + "+".join(
+            f"between(n\\,{first - 1}\\,{last - 1})" for first, last in ranges
+        )
+        filters += [f"{refVideo}{selection}[refsel]"]
+        filters += [f"{renVideo}{selection}[rensel]"]
+        refVideo, renVideo = "[refsel]", "[rensel]"
+        # stop decoding after the last compared frame
+        frameLimit = ["-frames:v", str(len(videoFrames))]
+
+    videoFilters = sorted(parser.filters)
+    if len(videoFilters) == 1:
+        videoInputs = [(refVideo, renVideo)]
     else:
-        # job succeded
-        return CompareResult(CompareResultStatus.SUCCESS)
+        count = len(videoFilters)
+        filters += [
+            f"{refVideo}split={count}" + "".join(f"[ref{i}]" for i in range(count)),
+            f"{renVideo}split={count}" + "".join(f"[ren{i}]" for i in range(count)),
+        ]
+        videoInputs = [(f"[ref{i}]", f"[ren{i}]") for i in range(count)]
+
+    # all filters write their stats to stdout
+    for videoFilter, (refInput, renInput) in zip(videoFilters, videoInputs):
+        filters += [f"{refInput}{renInput}{videoFilter}=f=-[{videoFilter}]"]
+        outputs += ["-map", f"[{videoFilter}]"] + frameLimit
+        outputs += ["-f", "null", os.devnull]
+
+    cmd = ffmpegCommand + [
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        referenceFile,
+        "-i",
+        lastRender,
+        "-filter_complex",
+        ";".join(filters),
+    ]
+    cmd += outputs
+
+    with subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    ) as process:
+        assert process.stdout and process.stderr
+        stderrReader = PipeReader(process.stderr)
+        parser.parseStream(process.stdout, process)
+        process.wait()
+        stderrReader.join()
+
+    # Check if process failed
+    if process.returncode != 0 and not parser.aborted:
+        res = CompareResult(
+            CompareResultStatus.PROCESS_FAILURE, "video comparison failed"
+        )
+        res.errorDetails = stderrReader.content
+        return res
+
+    return parser.result()
@@ -6,30 +6,43 @@
 
 
 import argparse
+import json
 import os
 import re
 import subprocess
 import sys
 import webbrowser
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Optional
 
 import yaml
 
-from audioCompare import audioCompare
+from avCompare import avCompare
+from Benchmark import Benchmark, BenchmarkResult
 from CompareResult import CompareResult, CompareResultStatus
 from Config import ProjectConfig
-from Metadata import Metadata, compareMetadata
-from pnsr import pnsrCompare
+from FrameHashes import compareFrameHashes, updateReferenceHashes
+from Metadata import compareMetadata, mediaInfo
+from pnsr import FailFast
+from ReferenceCache import ReferenceCache
+from RenderCache import RenderCache
+from RenderLog import RenderLog
 
 # from compare_renders import compareRenders
 from RenderProject import RenderProject
+from ResultsHistory import ResultsHistory
 from ResultSummary import ResultSummary
+from VideoComparators import createComparators
 
 # assign directory
 projectFolder = "projects"
 tmpFolder = os.path.join(".", "tmp")
 outFolder = os.path.join(".", "renders")
+logFolder = os.path.join(".", "logs")
 refFolder = os.path.abspath("reference")
+renderCacheFolder = os.path.join(".", "cache", "renders")
+referenceCacheFolder = os.path.join(".", "cache", "references")
 
 parser = argparse.ArgumentParser(
     description="Tooling for testing Kdenlive render functionality"
@@ -47,12 +60,165 @@ parser.add_argument(
     "--regex-filter",
     help="Regular expression to filter test names. Only tests matching the expression will be executed.",
 )
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    # Kdenlive renders are multithreaded themselves, so don't use all cores
+    default=max(1, (os.cpu_count() or 1) // 2),
+    help="Number of projects to render in parallel (default: half the number of CPU cores)",
+)
+parser.add_argument(
+    "--compare-jobs",
+    type=int,
+    help="Number of renders to compare in parallel (default: same as --jobs)",
+)
+parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="Do not use or update the render and reference caches",
+)
+parser.add_argument(
+    "--cache-size",
+    type=int,
+    default=2048,
+    help="Maximum size of the render cache in MiB (default: 2048)",
+)
+parser.add_argument(
+    "--prewarm-reference-cache",
+    action="store_true",
+    help="Analyse all references, remove outdated reference cache entries and exit",
+)
+parser.add_argument(
+    "--no-framehash",
+    action="store_true",
+    help="Always run the full comparison, even if the frame hashes match the reference hashes",
+)
+parser.add_argument(
+    "--update-reference-hashes",
+    action="store_true",
+    help="Write the frame hashes of all references next to them and exit",
+)
+parser.add_argument(
+    "--fail-fast-frames",
+    type=int,
+    default=0,
+    help="Stop the video comparison of a project after N broken frames (default: 0, disabled)",
+)
+parser.add_argument(
+    "--fail-fast-ranges",
+    type=int,
+    default=0,
+    help="Stop the video comparison of a project after N broken frame ranges (default: 0, disabled)",
+)
+parser.add_argument(
+    "--align-audio",
+    action="store_true",
+    help="Compare the render audio after shifting it by a detected offset to the reference",
+)
+parser.add_argument(
+    "--no-thumbnails",
+    action="store_true",
+    help="Do not create comparison images for broken frames in the HTML report",
+)
+parser.add_argument(
+    "--thumbnail-format",
+    choices=["png", "jpeg", "webp"],
+    default="png",
+    help="Image format of the comparison images (default: png)",
+)
+parser.add_argument(
+    "--thumbnail-quality",
+    type=int,
+    default=85,
+    help="Quality of jpeg and webp comparison images (default: 85)",
+)
+parser.add_argument(
+    "--thumbnail-scale",
+    type=float,
+    default=1.0,
+    help="Scale factor for the comparison images (default: 1.0)",
+)
+parser.add_argument(
+    "--thumbnail-full-res-first-range",
+    action="store_true",
+    help="Do not scale the comparison images of the first error range of a project",
+)
+parser.add_argument(
+    "--thumbnail-max-ranges",
+    type=int,
+    default=20,
+    help="Maximum number of error ranges with comparison images per project,"
+    " sampled from first, worst, last and evenly spaced ranges (default: 20, 0 = unlimited)",
+)
+parser.add_argument(
+    "--thumbnail-budget",
+    type=int,
+    default=0,
+    help="Maximum size of all comparison images in MiB (default: 0, unlimited)",
+)
+parser.add_argument(
+    "--junit-log-head",
+    type=int,
+    default=100,
+    help="Number of first render log lines included in the JUnit report (default: 100)",
+)
+parser.add_argument(
+    "--junit-log-tail",
+    type=int,
+    default=200,
+    help="Number of last render log lines kept in memory and included in the JUnit report (default: 200)",
+)
+parser.add_argument(
+    "--no-history",
+    action="store_true",
+    help="Do not record the results in the results history database",
+)
+parser.add_argument(
+    "--history-db",
+    default=os.path.join(".", "cache", "history.sqlite"),
+    help="Results history database (default: cache/history.sqlite)",
+)
+parser.add_argument(
+    "--history-baseline",
+    type=int,
+    default=5,
+    help="Number of previous runs used as baseline for regressions (default: 5)",
+)
+parser.add_argument(
+    "--history-report",
+    action="store_true",
+    help="Only report regressions of the latest recorded run against the baseline and exit",
+)
+parser.add_argument(
+    "--benchmark",
+    type=int,
+    default=0,
+    metavar="N",
+    help="Render each project N times one after another and report the render times instead of comparing",
+)
+parser.add_argument(
+    "--benchmark-warmup",
+    type=int,
+    default=1,
+    help="Number of renders per project before the measured benchmark runs (default: 1)",
+)
+parser.add_argument(
+    "--benchmark-baseline",
+    help="Benchmark results (e.g. a previous benchmark.json) to compare the render times with",
+)
+parser.add_argument(
+    "--slowest",
+    type=int,
+    default=10,
+    help="Number of slowest projects and phases listed in the summary (default: 10)",
+)
 
 args = parser.parse_args()
 
 
 def setupFileStructure() -> bool:
-    for folder in [tmpFolder, outFolder]:
+    for folder in [tmpFolder, outFolder, logFolder]:
         if not os.path.isdir(folder):
             os.mkdir(folder)
 
@@ -68,7 +234,9 @@ def setupFileStructure() -> bool:
     return True
 
 
-def renderKdenliveProject(project: RenderProject) -> None:
+def renderKdenliveProject(
+    project: RenderProject, renderCache: Optional[RenderCache]
+) -> None:
     outputFile = os.path.join(outFolder, project.renderFilename)
 
     # ensure destination render does not exists
@@ -77,6 +245,33 @@ def renderKdenliveProject(project: RenderProject) -> None:
         print(f"Clearing previous render: {outputFile}")
         os.remove(outputFile)
 
+    # kdenlive writes the (debug) logs directly into files, only their last
+    # lines are kept in memory
+    project.renderLog = RenderLog(
+        Path(logFolder) / f"{project.name}.stdout.log", args.junit_log_tail
+    )
+    project.renderErrorLog = RenderLog(
+        Path(logFolder) / f"{project.name}.stderr.log", args.junit_log_tail
+    )
+
+    cacheKey = ""
+    if renderCache:
+        cacheKey = renderCache.key(project)
+        with project.timings.measure("render"):
+            restored = renderCache.restore(cacheKey, Path(outputFile))
+        if restored:
+            project.renderCached = True
+            project.renderLog.logFile.write_text(
+                f"Render restored from cache (key {cacheKey})\n"
+            )
+            project.renderLog.loadTail()
+            project.renderErrorLog.logFile.write_text("")
+            print(
+                f"Rendering project: {project!s}... restored from cache",
+                flush=True,
+            )
+            return
+
     print(
         f"Processing project: {project!s} to destination: {outputFile}",
         flush=True,
@@ -92,14 +287,26 @@ def renderKdenliveProject(project: RenderProject) -> None:
 
     print("Starting command: ", cmd, flush=True)
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    with project.timings.measure("render"):
+        with open(project.renderLog.logFile, "wb") as stdout, open(
+            project.renderErrorLog.logFile, "wb"
+        ) as stderr:
+            result = subprocess.run(cmd, stdout=stdout, stderr=stderr)
 
-    project.renderLog = result.stdout
-    project.renderErrorLog = result.stderr
+    project.renderLog.loadTail()
+    project.renderErrorLog.loadTail()
 
     if result.returncode != 0:
-        print(result.stdout)
-        print(result.stderr)
+        # print as one chunk to avoid mixing with the output of parallel renders
+        print(
+            f"Rendering project {project!s} failed (full logs:"
+            f" {project.renderLog.logFile}, {project.renderErrorLog.logFile}):\n"
+            f"{project.renderLog}\n{project.renderErrorLog}",
+            flush=True,
+        )
+
+    if renderCache and result.returncode == 0 and os.path.isfile(outputFile):
+        renderCache.store(cacheKey, Path(outputFile))
 
     print(
         f"Rendering project: {project!s}... DONE, return code {result.returncode}",
@@ -114,50 +321,199 @@ def openWebBrowser(filename: str) -> None:
         print(f"Could not start Firefox... please open the {filename} file manually")
 
 
-def compareRenders(
-    projects: list[RenderProject],
-) -> list[tuple[RenderProject, CompareResult]]:
-    results: list[tuple[RenderProject, CompareResult]] = []
-    for ix, project in enumerate(projects):
-        refFilePath = os.path.join(refFolder, project.renderFilename)
+def compareRender(project: RenderProject, ix: int, total: int) -> CompareResult:
+    refFilePath = os.path.join(refFolder, project.renderFilename)
 
-        # checking if it is a file
-        if not os.path.isfile(refFilePath):
-            results += [(project, CompareResult(CompareResultStatus.MISSING_REFERENCE))]
-            continue
+    # checking if it is a file
+    if not os.path.isfile(refFilePath):
+        return CompareResult(CompareResultStatus.MISSING_REFERENCE)
 
-        # ensure destination render exists
-        print(
-            f"CHECKING FILE [{ix + 1}/{len(projects)}]: {project.renderFilename}, ref: {refFilePath}",
-            flush=True,
-        )
-        renderPath = os.path.join(outFolder, project.renderFilename)
-        if not os.path.isfile(renderPath):
-            results += [(project, CompareResult(CompareResultStatus.MISSING_RENDER))]
-            continue
+    # ensure destination render exists
+    print(
+        f"CHECKING FILE [{ix}/{total}]: {project.renderFilename}, ref: {refFilePath}",
+        flush=True,
+    )
+    renderPath = os.path.join(outFolder, project.renderFilename)
+    if not os.path.isfile(renderPath):
+        return CompareResult(CompareResultStatus.MISSING_RENDER)
+
+    with project.timings.measure("metadata"):
+        if referenceCache:
+            refMetadata = referenceCache.metadata(refFilePath)
+        else:
+            refMetadata = mediaInfo(refFilePath)
+        renderMetadata = mediaInfo(renderPath)
+
+    compareResult = compareMetadata(refMetadata, renderMetadata)
+
+    # streams missing in the render can not be decoded, report them separately
+    # so the comparison of the other streams still takes place
+    compareVideo = len(refMetadata.videoStreams) > 0
+    if compareVideo and len(renderMetadata.videoStreams) == 0:
+        compareVideo = False
+        missingVideo = CompareResult(CompareResultStatus.PROCESS_FAILURE)
+        missingVideo.errorDetails = "The render has no video stream"
+        compareResult += missingVideo
+
+    compareAudio = len(refMetadata.audioStreams) > 0
+    if compareAudio and len(renderMetadata.audioStreams) == 0:
+        compareAudio = False
+        missingAudio = CompareResult(CompareResultStatus.PROCESS_FAILURE)
+        missingAudio.errorDetails = "The render has no audio stream"
+        compareResult += missingAudio
+
+    # streams with frames identical to the precomputed reference hashes do not
+    # need the full comparison, of the other video streams only the frames
+    # with different hashes are compared
+    videoFrames = None
+    videoFrameCount = 0
+    if (compareVideo or compareAudio) and not args.no_framehash:
+        with project.timings.measure("framehash"):
+            try:
+                hashComparison = compareFrameHashes(refFilePath, renderPath)
+            except Exception as err:
+                print(f"Frame hash comparison failed: {err}", flush=True)
+                hashComparison = None
+        if hashComparison:
+            identical = hashComparison.identicalStreams
+            compareVideo = compareVideo and "video" not in identical
+            compareAudio = compareAudio and "audio" not in identical
+            videoFrames = hashComparison.suspectFrames("video")
+            videoFrameCount = hashComparison.frameCount("video")
+
+    referenceAudio = None
+    if compareAudio and referenceCache:
+        with project.timings.measure("reference-audio"):
+            try:
+                referenceAudio = referenceCache.audioData(refFilePath)
+            except Exception as err:
+                # a failed decode of the reference only fails the audio
+                compareAudio = False
+                audioFailure = CompareResult(
+                    CompareResultStatus.PROCESS_FAILURE, "audio comparison failed"
+                )
+                audioFailure.errorDetails = str(err)
+                compareResult += audioFailure
+
+    compareResult += avCompare(
+        refFilePath,
+        renderPath,
+        project.propFps,
+        compareVideo,
+        compareAudio,
+        timings=project.timings,
+        failFast=FailFast(args.fail_fast_frames, args.fail_fast_ranges),
+        referenceAudio=referenceAudio,
+        comparators=createComparators(project.metrics),
+        videoFrames=videoFrames,
+        videoFrameCount=videoFrameCount,
+        alignAudio=args.align_audio,
+    )
 
-        refMetadata = Metadata(refFilePath)
-        renderMetadata = Metadata(f"renders/{project.renderFilename}")
+    return compareResult
 
-        compareResult = compareMetadata(refMetadata, renderMetadata)
 
-        if len(refMetadata.videoStreams) > 0:
-            videoCompareResult = pnsrCompare(
-                refFilePath, f"renders/{project.renderFilename}"
-            )
-            compareResult += videoCompareResult
+def renderAndCompareProjects(
+    projects: list[RenderProject],
+    renderJobs: int,
+    compareJobs: int,
+    renderCache: Optional[RenderCache],
+) -> list[tuple[RenderProject, CompareResult]]:
+    # Renders and comparisons run on separate pools: each finished render is
+    # compared while other projects are still rendering. The results keep the
+    # order of the given projects.
+    compareFutures: dict[int, Future[CompareResult]] = {}
+
+    with ThreadPoolExecutor(max_workers=compareJobs) as comparePool:
 
-        if len(refMetadata.audioStreams) > 0:
-            audioCompareResult = audioCompare(
-                refFilePath, f"renders/{project.renderFilename}", project.propFps
+        def submitCompare(ix: int) -> None:
+            compareFutures[ix] = comparePool.submit(
+                compareRender, projects[ix], ix + 1, len(projects)
             )
-            compareResult += audioCompareResult
 
-        results += [(project, compareResult)]
+        if args.check_only:
+            for ix in range(len(projects)):
+                submitCompare(ix)
+        else:
+            print(
+                f"Rendering {len(projects)} project(s) with {renderJobs} job(s)",
+                flush=True,
+            )
+            with ThreadPoolExecutor(max_workers=renderJobs) as renderPool:
+                renderFutures = {
+                    renderPool.submit(renderKdenliveProject, project, renderCache): ix
+                    for ix, project in enumerate(projects)
+                }
+                for future in as_completed(renderFutures):
+                    # propagate exceptions from the render workers
+                    future.result()
+                    submitCompare(renderFutures[future])
+
+        return [
+            (project, compareFutures[ix].result())
+            for ix, project in enumerate(projects)
+        ]
+
+
+def benchmarkProjects(
+    projects: list[RenderProject], runs: int, warmup: int
+) -> list[BenchmarkResult]:
+    # the projects are rendered one after another without the render cache,
+    # so parallel renders do not compete for the CPU
+    results = []
+    for project in projects:
+        renderPath = os.path.join(outFolder, project.renderFilename)
+        durations: list[float] = []
+        for run in range(warmup + runs):
+            renderTime = project.timings.phases.get("render", 0.0)
+            renderKdenliveProject(project, None)
+            if not os.path.isfile(renderPath):
+                print(f"Rendering {project!s} failed, skipping the benchmark")
+                break
+            if run >= warmup:
+                durations += [project.timings.phases["render"] - renderTime]
+
+        if durations:
+            frameCount = mediaInfo(renderPath).frameCount
+            results += [BenchmarkResult(project.name, durations, frameCount)]
 
     return results
 
 
+referenceCache: Optional[ReferenceCache] = None
+if not args.no_cache:
+    referenceCache = ReferenceCache(Path(referenceCacheFolder))
+
+if args.update_reference_hashes:
+    for referenceFile in sorted(str(f) for f in Path(refFolder).iterdir()):
+        if not os.path.isfile(referenceFile) or referenceFile.endswith(".framehash"):
+            continue
+        print(f"Hashing reference: {referenceFile}", flush=True)
+        try:
+            updateReferenceHashes(referenceFile)
+        except Exception as err:
+            print(err, flush=True)
+    sys.exit()
+
+if args.prewarm_reference_cache:
+    if not referenceCache:
+        sys.exit("The reference cache is disabled")
+    referenceFiles = sorted(
+        str(f)
+        for f in Path(refFolder).iterdir()
+        if f.is_file() and f.suffix != ".framehash"
+    )
+    referenceCache.prune(referenceFiles)
+    referenceCache.prewarm(referenceFiles)
+    sys.exit()
+
+if args.history_report:
+    history = ResultsHistory(Path(args.history_db))
+    print(history.report(args.history_baseline))
+    if history.regressions(args.history_baseline):
+        sys.exit("Regressions found")
+    sys.exit()
+
 # ensure the folders exist
 if not setupFileStructure():
     sys.exit()
@@ -177,15 +533,12 @@ for item in projectsConfig:
         continue
 
     if project.propFps > 0:
-        if not args.check_only:
-            renderKdenliveProject(project)
         projects += [project]
 
 projects = [i for i in sorted(projects, key=lambda p: str(p.projectPath))]
 
-res = compareRenders(projects)
-
 # Get Kdenlive version info
+hasSetupReport = False
 cmd = args.kdenlive_exec.split()
 cmd += ["--help"]
 result = subprocess.run(cmd, capture_output=True, text=True)
@@ -194,14 +547,72 @@ if "--setup-report" in result.stdout:
     cmd += ["--setup-report"]
     cmd += [Path("components.json")]
     result = subprocess.run(cmd, capture_output=True, text=True)
+    hasSetupReport = result.returncode == 0
+
+renderCache: Optional[RenderCache] = None
+if not args.check_only and not args.no_cache:
+    # without the component versions the Kdenlive build can not be identified
+    buildInfo = None
+    if hasSetupReport:
+        buildInfo = RenderCache.buildInfoFromComponents(Path("components.json"))
+    if buildInfo:
+        renderCache = RenderCache(
+            Path(renderCacheFolder), args.cache_size * 1024 * 1024, buildInfo
+        )
+    else:
+        print("No Kdenlive component versions available, render cache disabled")
+
+if args.benchmark > 0:
+    if args.check_only:
+        sys.exit("The benchmark needs to render the projects")
+    benchmark = Benchmark(
+        benchmarkProjects(projects, args.benchmark, max(0, args.benchmark_warmup))
+    )
+    components = None
+    if hasSetupReport:
+        with open("components.json", mode="r", encoding="utf-8") as read_file:
+            components = json.load(read_file)
+    benchmark.save(Path("benchmark.json"), components)
+
+    baseline = None
+    if args.benchmark_baseline:
+        baseline = Benchmark.loadBaseline(Path(args.benchmark_baseline))
+    print(benchmark.report(baseline))
+    if baseline and benchmark.slowdowns(baseline):
+        sys.exit("Significant slowdowns found")
+    sys.exit()
+
+renderJobs = max(1, args.jobs)
+compareJobs = max(1, args.compare_jobs or renderJobs)
+res = renderAndCompareProjects(projects, renderJobs, compareJobs, renderCache)
 
 summary = ResultSummary(res, outFolder, refFolder)
+summary.slowestCount = args.slowest
+summary.jobs = compareJobs
+summary.thumbnails = not args.no_thumbnails
+summary.thumbnailFormat = args.thumbnail_format
+summary.thumbnailQuality = args.thumbnail_quality
+summary.thumbnailScale = args.thumbnail_scale
+summary.thumbnailFullResFirstRange = args.thumbnail_full_res_first_range
+summary.thumbnailMaxRanges = args.thumbnail_max_ranges
+summary.junitLogHeadLines = args.junit_log_head
+summary.thumbnailBudget = args.thumbnail_budget * 1024 * 1024
 
 summary.saveHtmlToFile(Path("result.html"))
 summary.saveJUnitToFile(Path("JUnitRenderTestResults.xml"))
+summary.saveTimingsToFile(Path("timings.json"))
 
 print(summary)
 
+if not args.no_history:
+    components = None
+    if hasSetupReport:
+        with open("components.json", mode="r", encoding="utf-8") as read_file:
+            components = json.load(read_file)
+    history = ResultsHistory(Path(args.history_db))
+    history.record(res, components)
+    print(history.report(args.history_baseline))
+
 openWebBrowser("result.html")
 
 # Compare the results with the references